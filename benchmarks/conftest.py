@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_disk_cache(monkeypatch):
+    '''Benchmarks measure the work, not a RYZOM_CACHE_DIR of a previous run.'''
+    monkeypatch.delenv('RYZOM_CACHE_DIR', raising=False)
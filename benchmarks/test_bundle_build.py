@@ -0,0 +1,59 @@
+'''
+Full bundle builds of the example project, from scratch and incremental,
+and the ryzom_bundle command.
+'''
+import io
+
+import pytest
+from django.core.management import call_command
+
+from ryzom import bundle, cache
+from ryzom.bundle.css import cache as sass_cache
+from ryzom_django import bundle as django_bundle
+
+pytest.importorskip('pytest_benchmark')
+
+MODULES = (
+    'ryzom_mdc.html',
+    'ryzom_django_mdc.html',
+    'ryzom_django.html',
+    'ryzom_django_example.views',
+)
+
+
+def clear():
+    cache.pieces.clear()
+    sass_cache.clear()
+
+
+def test_js_cold(benchmark):
+    benchmark.pedantic(bundle.js, args=MODULES, setup=clear, rounds=5)
+
+
+def test_js_incremental(benchmark):
+    benchmark(bundle.js, *MODULES)
+
+
+def test_css_cold(benchmark):
+    benchmark.pedantic(bundle.css, args=MODULES, setup=clear, rounds=5)
+
+
+def test_css_incremental(benchmark):
+    benchmark(bundle.css, *MODULES)
+
+
+def clear_discovery():
+    clear()
+    django_bundle.get_component_modules.cache_clear()
+    django_bundle.known_classes.cache_clear()
+    django_bundle.code_classes.cache_clear()
+
+
+def test_ryzom_bundle(benchmark, tmp_path, monkeypatch):
+    '''The command from scratch, with the discovery of the example apps.'''
+    monkeypatch.setattr(django_bundle, 'STATIC_PATH', str(tmp_path))
+    benchmark.pedantic(
+        call_command, args=('ryzom_bundle',), kwargs=dict(stdout=io.StringIO()),
+        setup=clear_discovery, rounds=5,
+    )
+    assert (tmp_path / 'bundle.json').exists()
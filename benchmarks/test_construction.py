@@ -0,0 +1,33 @@
+'''
+Component construction microbenchmarks.
+
+Run with: py.test benchmarks --benchmark-autosave, and compare with
+--benchmark-compare after a change.
+'''
+import pytest
+
+from ryzom import html
+from ryzom_mdc.html import MDCTextFieldOutlined
+
+pytest.importorskip('pytest_benchmark')
+
+
+def test_div(benchmark):
+    benchmark(html.Div, 'hello', cls='foo')
+
+
+def test_text(benchmark):
+    benchmark(html.Text, 'hello')
+
+
+def test_div_rows(benchmark):
+    benchmark(lambda: html.Div(*[html.Div(str(i)) for i in range(1000)]))
+
+
+def test_mdc_text_field_outlined(benchmark):
+    benchmark(
+        lambda: MDCTextFieldOutlined(
+            html.Input(name='email', type='email'),
+            label='Email',
+        )
+    )
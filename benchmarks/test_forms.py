@@ -0,0 +1,30 @@
+'''
+Rendering of Django forms with ryzom_django_mdc widgets.
+'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from django import forms
+
+from ryzom_django_example.views import ExampleForm
+
+
+class WideForm(forms.Form):
+    '''50 MDCTextFieldOutlined, with errors.'''
+    locals().update({
+        f'field{i}': forms.CharField(label=f'Field {i}', help_text='Help')
+        for i in range(50)
+    })
+
+
+def test_example_form(benchmark):
+    benchmark(lambda: ExampleForm().to_html())
+
+
+def test_example_form_errors(benchmark):
+    benchmark(lambda: ExampleForm(dict(email='foo')).to_html())
+
+
+def test_wide_form_errors(benchmark):
+    benchmark(lambda: WideForm(dict(field0='x')).to_html())
@@ -0,0 +1,39 @@
+'''
+Cold start cost of importing ryzom modules, in a new interpreter each
+round.
+
+The benchmark times the whole interpreter, extra_info holds the
+cumulative microseconds python -X importtime reports for the module.
+'''
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+
+def importtime(module):
+    '''Return the cumulative import time of module in a new interpreter.'''
+    env = {
+        key: value for key, value in os.environ.items()
+        if key != 'PYTHONDONTWRITEBYTECODE'
+    }
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env, stderr=subprocess.PIPE, check=True, text=True,
+    ).stderr
+    for line in stderr.splitlines():
+        self, cumulative, name = line.split('|')
+        if name.strip() == module:
+            return int(cumulative)
+
+
+@pytest.mark.parametrize('module', ['ryzom.html', 'ryzom_mdc.html'])
+def test_importtime(benchmark, module):
+    importtime(module)  # write bytecode first
+    results = []
+    benchmark.pedantic(
+        lambda: results.append(importtime(module)), rounds=5)
+    benchmark.extra_info['importtime_us'] = sorted(results)[len(results) // 2]
@@ -0,0 +1,42 @@
+'''
+Construction and rendering of big trees.
+'''
+import pytest
+
+from ryzom import html
+
+pytest.importorskip('pytest_benchmark')
+
+
+def table(rows):
+    return html.Table(
+        html.Thead(html.Tr(html.Th('#'), html.Th('label'))),
+        html.Tbody(*[
+            html.Tr(html.Td(i), html.Td(f'row {i}', cls='label'))
+            for i in range(rows)
+        ]),
+    )
+
+
+def ul(rows):
+    return html.Ul(*[html.Li(f'item {i}') for i in range(rows)])
+
+
+def test_table_10k_construct(benchmark):
+    benchmark(table, 10000)
+
+
+def test_table_10k_render(benchmark):
+    benchmark(table(10000).render)
+
+
+def test_table_10k_construct_render(benchmark):
+    benchmark(lambda: table(10000).render())
+
+
+def test_ul_10k_construct_render(benchmark):
+    benchmark(lambda: ul(10000).render())
+
+
+def test_ul_10k_stream(benchmark):
+    benchmark(lambda: sum(1 for chunk in ul(10000).iter_html()))
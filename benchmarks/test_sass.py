@@ -0,0 +1,52 @@
+'''
+Sass bundling of 500 synthetic components, one libsass call per component
+versus compile_batch().
+'''
+import textwrap
+
+import pytest
+
+from ryzom import cache
+from ryzom.bundle.css import cache as sass_cache, compile_batch, components
+from ryzom.components import ComponentMetaclass
+from ryzom.html import Div
+
+pytest.importorskip('pytest_benchmark')
+sass = pytest.importorskip('sass')
+
+
+classes = [
+    ComponentMetaclass(f'Sass{i}', (Div,), dict(
+        __module__=__name__,
+        sass=f'''
+        .Sass{i}
+            margin: {i}px
+            .child
+                display: flex
+            &:hover
+                color: red
+        ''',
+    ))
+    for i in range(500)
+]
+sources = [textwrap.dedent(cls.sass) for cls in classes]
+
+
+def clear():
+    sass_cache.clear()
+    cache.pieces.clear()
+
+
+def test_compile_one_by_one(benchmark):
+    benchmark.pedantic(
+        lambda: [sass.compile(string=src, indented=True) for src in sources],
+        rounds=5,
+    )
+
+
+def test_compile_batch(benchmark):
+    benchmark.pedantic(compile_batch, args=(sources,), setup=clear, rounds=5)
+
+
+def test_components(benchmark):
+    benchmark.pedantic(components, args=classes, setup=clear, rounds=5)
@@ -0,0 +1,22 @@
+'''
+Serialization of DDP insert/change payloads.
+'''
+import pytest
+
+from ryzom import html
+
+pytest.importorskip('pytest_benchmark')
+
+
+class Row(html.Tr):
+    def __init__(self, i):
+        self.label = f'row {i}'
+        super().__init__(html.Td(i), html.Td(self.label, cls='label'))
+
+    def py2js(self):
+        getElementByUuid(self.id).title = self.label
+
+
+def test_to_obj_table(benchmark):
+    table = html.Table(*[Row(i) for i in range(1000)], parent='p')
+    benchmark(table.to_obj)
@@ -0,0 +1,47 @@
+'''
+Transpilation of py2js methods, with an empty and a warm cache.
+'''
+import pytest
+
+from py2js import transpiler
+from py2js.transpiler import transpile_body
+from ryzom.bundle.js import build
+from ryzom_mdc import html as mdc
+
+pytest.importorskip('pytest_benchmark')
+
+
+class Component(mdc.Div):
+    def py2js(self):
+        elem = getElementByUuid(self.id)
+        for child in elem.children:
+            if child.value:
+                child.classList.add('filled')
+            else:
+                child.classList.remove('filled')
+        elem.addEventListener('click', lambda event: print(event.target))
+
+
+def clear():
+    transpiler.cache.clear()
+    transpiler._getsource.cache_clear()
+    transpiler.context_names.cache_clear()
+    transpiler.body_source.cache_clear()
+
+
+def test_transpile_body_cold(benchmark):
+    component = Component()
+    benchmark.pedantic(
+        lambda: transpile_body(component.py2js, self=component),
+        setup=clear, rounds=100,
+    )
+
+
+def test_transpile_body_warm(benchmark):
+    component = Component()
+    benchmark(lambda: transpile_body(component.py2js, self=component))
+
+
+def test_build_mdc_dialog(benchmark):
+    benchmark.pedantic(
+        build, args=(mdc.MDCDialog,), setup=clear, rounds=20)
@@ -1,10 +1,13 @@
 #! /usr/bin/env python
 
 import ast
+import functools
 import inspect
 import textwrap
 import re
 
+from ryzom.cache import LRUCache, disk_cache, stable_key
+
 from . import formater
 
 
@@ -717,20 +720,142 @@ class JS(object):
         return f"{args}.length"
 
 
+cache = LRUCache(maxsize=1024)
+PLACEHOLDER = '"py2js-placeholder-{}"'
+
+
+@functools.lru_cache(maxsize=1024)
+def _getsource(obj):
+    return inspect.getsource(obj)
+
+
+def getsource(obj):
+    '''Return the source of obj, cached per function.'''
+    return _getsource(getattr(obj, '__func__', obj))
+
+
+@functools.lru_cache(maxsize=1024)
+def context_names(s):
+    '''
+    Return the names and (name, attribute) pairs that source s uses.
+
+    These are the only context values that the transpiler may inline.
+    '''
+    names, attributes = set(), set()
+    tree = ast.parse(textwrap.dedent(s))
+    bases = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            attributes.add((node.value.id, node.attr))
+            bases.add(id(node.value))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in bases:
+            name = JS.name_map.get(node.id, node.id)
+            if name not in JS.builtin:
+                names.add(name)
+    return frozenset(names), frozenset(attributes)
+
+
+class Uncacheable(Exception):
+    pass
+
+
+@functools.lru_cache()
+def _proxy_class(name):
+    return type(name, (), {})
+
+
+def _template(value, key, strings):
+    '''Return what to transpile value as, and add what it depends on to key.'''
+    if isinstance(value, str):
+        strings.append((PLACEHOLDER.format(len(strings)), f'"{value}"'))
+        key.append(str)
+        return strings[-1][0][1:-1]
+    if isinstance(value, (int, float, type(None))):
+        key.append((type(value), value))
+    elif inspect.isroutine(value) or inspect.isclass(value):
+        # JS names functions after the class that defines them
+        self = getattr(value, '__self__', None)
+        key.append((getattr(value, '__func__', value), type(self)))
+    else:
+        raise Uncacheable()
+    return value
+
+
+def template_context(s, context):
+    '''
+    Return a cache key, template context and placeholders for s.
+
+    String values are replaced with placeholders so that the result of a
+    transpilation can be reused with other strings, ie. self.id, other
+    values go in the key. The key is None for values that can't be keyed
+    safely, such as arbitrary objects.
+    '''
+    names, attributes = context_names(s)
+    key, strings, template = [s], [], dict()
+    try:
+        for name, value in sorted(context.items()):
+            if inspect.isroutine(value) or inspect.isclass(value):
+                # JS() transpiles those as they are
+                key.append((name, value))
+                template[name] = value
+                continue
+
+            used = sorted(attr for base, attr in attributes if base == name)
+            present = [attr for attr in used if hasattr(value, attr)]
+            key.append((name, *present))
+            if name in names or (
+                len(present) < len(used)
+                and name not in JS.name_map
+                and name not in JS.builtin
+            ):
+                if present:
+                    raise Uncacheable()
+                template[name] = _template(value, key, strings)
+            elif present:
+                proxy = _proxy_class(type(value).__name__)()
+                if hasattr(value, '__name__'):
+                    proxy.__name__ = value.__name__
+                for attr in present:
+                    setattr(proxy, attr, _template(
+                        getattr(value, attr), key, strings))
+                template[name] = proxy
+    except Uncacheable:
+        return None, context, []
+    return tuple(key), template, strings
+
+
 def convert_py2js(s, context=None):
     """
     Takes Python code as a string 's' and converts this to JavaScript.
 
+    Results are cached per source and context, see template_context(), and
+    on disk if RYZOM_CACHE_DIR is set.
+
     Example:
 
     >>> convert_py2js("x[3:]")
     'x.__getitem__(slice(3, null));'
 
     """
-    t = ast.parse(textwrap.dedent(s))
-    v = JS(context)
-    v.visit(t)
-    js = v.read()
+    key, context, strings = template_context(s, context or {})
+    js = cache.get(key) if key else None
+    if js is None:
+        disk = disk_cache() if key else None
+        disk_key = stable_key(key) if disk else None
+        if disk_key:
+            js = disk.get(disk_key)
+        if js is None:
+            t = ast.parse(textwrap.dedent(s))
+            v = JS(context)
+            v.visit(t)
+            js = v.read()
+            if disk_key:
+                disk.set(disk_key, js)
+        if key:
+            cache.set(key, js)
+    for placeholder, value in strings:
+        js = js.replace(placeholder, value)
     return js
 
 
@@ -741,19 +866,22 @@ def transpile(obj_or_src, **context):
     if isinstance(obj_or_src, str):
         src = obj_or_src
     else:
-        src = inspect.getsource(obj_or_src)
+        src = getsource(obj_or_src)
     return convert_py2js(src, context)
 
 
-def transpile_body(obj, **context):
-    src = inspect.getsource(obj)
+@functools.lru_cache(maxsize=1024)
+def body_source(src):
     src = '\n'.join(src.split('\n')[1:])
-    src = textwrap.dedent(src)
-    return transpile(src, **context)
+    return textwrap.dedent(src)
+
+
+def transpile_body(obj, **context):
+    return transpile(body_source(getsource(obj)), **context)
 
 
 def transpile_class(cls, superclass=None, newname=None, **context):
-    src = inspect.getsource(cls)
+    src = getsource(cls)
     lines = src.split('\n')
     if newname:
         lines[0] = re.sub('class ([^:])*:', f'class {newname}:', lines[0])
@@ -765,7 +893,7 @@ def transpile_class(cls, superclass=None, newname=None, **context):
 
 
 def transpile_function(func, newname=None, **context):
-    src = inspect.getsource(func)
+    src = getsource(func)
     src = textwrap.dedent(src)
     lines = src.split('\n')
     if newname:
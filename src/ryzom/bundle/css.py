@@ -1,6 +1,12 @@
-import importlib
+import re
 import textwrap
 
+from ryzom.cache import (
+    LRUCache, build_pieces, cached_piece, disk_cache, fingerprint, importable,
+    piece,
+)
+from ryzom.components import registered
+
 try:
     import sass
 except:
@@ -27,28 +33,151 @@ def to_css(selector, style):
     return out
 
 
-def bundle(*modules):
+cache = LRUCache(4096)
+MARKER_RE = re.compile(r'/\*! ryzom-piece \d+ \*/\n')
+# could affect or depend on other sources in the same call
+UNBATCHABLE_RE = re.compile(
+    r'@(extend|import|use|forward|mixin|function)\b|^[$=]|[^\x00-\x7f]',
+    re.MULTILINE,
+)
+
+
+def compile_sass(src):
+    '''Compile indented sass, cached in memory and on disk by source.'''
+    if (css := cache.get(src)) is not None:
+        return css
+
+    disk = disk_cache()
+    if disk:
+        key = f'sass {sass.__version__} {src}'
+        if (css := disk.get(key)) is not None:
+            cache.set(src, css)
+            return css
+
+    css = sass.compile(string=src, indented=True)
+
+    cache.set(src, css)
+    if disk:
+        disk.set(key, css)
+    return css
+
+
+def compile_batch(sources):
+    '''
+    Compile the sources compile_sass() doesn't have in a single libsass
+    call, so that compile_sass() finds them.
+
+    Sources are separated by marker comments to split the output, which is
+    the same as compiling them one by one. Sources that could affect each
+    other are left for compile_sass(), as well as the whole batch on error
+    so that it raises for the culprit.
+    '''
+    disk = disk_cache()
+    missing = []
+    for src in dict.fromkeys(sources):
+        if src in cache or UNBATCHABLE_RE.search(src):
+            continue
+        if disk and disk.get(f'sass {sass.__version__} {src}') is not None:
+            continue
+        missing.append(src)
+    if len(missing) < 2:
+        return
+
+    try:
+        css = sass.compile(string='\n'.join(
+            f'/*! ryzom-piece {i} */\n{src}'
+            for i, src in enumerate(missing)
+        ), indented=True)
+    except sass.CompileError:
+        return
+
+    parts = MARKER_RE.split(css)[1:]
+    if len(parts) != len(missing):
+        return
+    for src, part in zip(missing, parts):
+        # sass separates blocks by an empty line
+        part = part.rstrip('\n') + '\n' if part.strip() else ''
+        cache.set(src, part)
+        if disk:
+            disk.set(f'sass {sass.__version__} {src}', part)
+
+
+def build(value):
+    '''Return the [kind, css] chunks of a component.'''
     out = []
-    done = []
-    for module in modules:
-        mod = importlib.import_module(module)
-        for key, value in mod.__dict__.items():
-            if not isinstance(value, type):
-                continue
-            if not hasattr(value, 'attrs'):
-                continue
-            if value in done:
-                continue
-            if sass_src := getattr(value, 'sass', None):
-                if not sass:
-                    raise Exception(f'Sass not installed, cannot bundle {key}')
-                css = sass.compile(
-                    string=textwrap.dedent(sass_src),
-                    indented=True
-                )
-                if css not in out:
-                    out.append(css)
-            if 'style' in value.attrs:
-                out += to_css('.' + value.__name__, value.attrs.style)
-            done.append(value)
+    if sass_src := getattr(value, 'sass', None):
+        if not sass:
+            raise Exception(f'Sass not installed, cannot bundle {value}')
+        out.append(['sass', compile_sass(textwrap.dedent(sass_src))])
+    if 'style' in value.attrs:
+        out += [
+            [None, line]
+            for line in to_css('.' + value.__name__, value.attrs.style)
+        ]
+    return out
+
+
+def components(*values, report=None, jobs=None):
+    '''
+    Return the CSS of component classes, sass they share is only added once.
+
+    The CSS of each component class is kept and only compiled again when
+    the sources it depends on change, add (piece, seconds) to the report
+    list for each class that was compiled.
+
+    Sass of the classes to build is compiled in a single libsass call, see
+    compile_batch(). With jobs, classes are compiled in that many
+    processes first, the output is the same.
+    '''
+    classes = [
+        value for value in values
+        if isinstance(value, type) and hasattr(value, 'attrs')
+    ]
+    if sass:
+        compile_batch([
+            textwrap.dedent(value.sass) for value in classes
+            if getattr(value, 'sass', None)
+            and cached_piece('css', value) is None
+        ])
+    if jobs:
+        build_pieces('css', classes, build, jobs, report)
+
+    out = []
+    done = set()
+    compiled = set()
+    for value in values:
+        if not isinstance(value, type):
+            continue
+        if not hasattr(value, 'attrs'):
+            continue
+        if value in done:
+            continue
+        if importable(value):
+            chunks = piece('css', value, build, report)
+        else:
+            # pieces are kept by name, which may not lead back to value
+            chunks = build(value)
+        for kind, css in chunks:
+            if kind == 'sass':
+                if css in compiled:
+                    continue
+                compiled.add(css)
+            out.append(css)
+        done.add(value)
     return '\n'.join(out)
+
+
+def bundle(*modules, report=None, jobs=None):
+    '''Return the CSS of components in modules, see components().'''
+    disk = disk_cache()
+    if disk:
+        cache_key = f'css bundle {fingerprint(*modules)}'
+        if (result := disk.get(cache_key)) is not None:
+            return result
+
+    result = components(
+        *registered(*modules, css=True), report=report, jobs=jobs)
+
+    if disk:
+        disk.set(cache_key, result)
+    return result
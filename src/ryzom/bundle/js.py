@@ -1,19 +1,16 @@
 import ast
-import inspect
-import importlib
 import py2js
-from py2js.transpiler import JS
+from py2js.transpiler import JS, getsource
 import re
 import textwrap
 
-
-AUTOCOMPILE = (
-    'onclick',
-    'onmouseover',
-    'onsubmit',
-    'onchange',
-    'oninput',
+from ryzom.cache import (
+    build_pieces, disk_cache, fingerprint, importable, piece,
 )
+from ryzom.components import AUTOCOMPILE, registered
+
+
+DEF_RE = re.compile(r'^def ')
 
 
 def webcomponent(value):
@@ -28,27 +25,28 @@ def webcomponent(value):
 
 
 
-def _functions(transpiler, done, **context):
+def _functions(transpiler, done, parent=None, **context):
+    '''Return [name, js, parent] chunks of functions transpiler found.'''
     out = []
     for name, func in transpiler._functions.items():
         if func in done:
             continue
-        func_src = textwrap.dedent(inspect.getsource(func))
+        func_src = textwrap.dedent(getsource(func))
         func_ast = ast.parse(func_src)
         func_ast.body[0].name = name
         func_js = JS()
         func_js._context = context
         func_js.visit(func_ast)
-        out.append(func_js.read())
+        out.append([name, func_js.read(), parent])
         if func_js._functions:
-            out += _functions(func_js, done, **context)
+            out += _functions(func_js, done, name, **context)
         done.append(func)
     return out
 
 
 def functions(value, done):
     out = []
-    tree = ast.parse(textwrap.dedent(inspect.getsource(value.py2js)))
+    tree = ast.parse(textwrap.dedent(getsource(value.py2js)))
     transpiler = JS()
     transpiler._context = dict(self=value)
     transpiler.visit(tree)
@@ -63,31 +61,82 @@ def methods(value, done_funcs):
         method = getattr(value, name, None)
         if not method:
             continue
-        src = textwrap.dedent(inspect.getsource(method))
-        src = re.sub(r'^def ', f'def {value.__name__}_', src)
+        src = textwrap.dedent(getsource(method))
+        src = DEF_RE.sub(f'def {value.__name__}_', src)
         tree = ast.parse(src)
         transpiler = JS()
         transpiler._context = dict(self=value)
         transpiler.visit(tree)
-        out += [transpiler.read()]
+        out += [[None, transpiler.read(), None]]
         out += _functions(transpiler, done_funcs, self=value)
 
     return out
 
 
-def bundle(*modules):
+def build(value):
+    '''Return the [name, js, parent] chunks of a component.'''
     out = []
     done = []
-    done_funcs = []
-    for module in modules:
-        mod = importlib.import_module(module)
-        for key, value in mod.__dict__.items():
-            if value in done:
+    if getattr(value, 'HTMLElement', None):
+        out += [[None, js, None] for js in webcomponent(value)]
+    if callable(getattr(value, 'py2js', None)):
+        out += functions(value, done)
+    out += methods(value, done)
+    return out
+
+
+def components(*values, report=None, jobs=None):
+    '''
+    Return the JS of components, functions they share are only added once.
+
+    The JS of each component class is kept and only transpiled again when
+    the sources it depends on change, add (piece, seconds) to the report
+    list for each class that was transpiled.
+
+    With jobs, classes are transpiled in that many processes first, the
+    output is the same.
+    '''
+    if jobs:
+        classes = [value for value in values if isinstance(value, type)]
+        build_pieces('js', classes, build, jobs, report)
+
+    out = []
+    done = set()
+    done_funcs = set()
+    for value in values:
+        if id(value) in done:
+            continue
+        if isinstance(value, type) and importable(value):
+            chunks = piece('js', value, build, report)
+        else:
+            # pieces are kept by name, which may not lead back to value
+            chunks = build(value)
+        # functions are shared by components, only add them once: by code
+        # too, because classes of the same name give their functions the
+        # same name
+        skipped = set()
+        for name, js, parent in chunks:
+            if (name, js) in done_funcs or parent in skipped:
+                skipped.add(name)
                 continue
-            if getattr(value, 'HTMLElement', None):
-                out += webcomponent(value)
-            if callable(getattr(value, 'py2js', None)):
-                out += functions(value, done_funcs)
-            out += methods(value, done_funcs)
-            done.append(value)
+            if name:
+                done_funcs.add((name, js))
+            out.append(js)
+        done.add(id(value))
     return '\n'.join(out)
+
+
+def bundle(*modules, report=None, jobs=None):
+    '''Return the JS of components in modules, see components().'''
+    disk = disk_cache()
+    if disk:
+        cache_key = f'js bundle {fingerprint(*modules)}'
+        if (result := disk.get(cache_key)) is not None:
+            return result
+
+    result = components(
+        *registered(*modules, js=True), report=report, jobs=jobs)
+
+    if disk:
+        disk.set(cache_key, result)
+    return result
@@ -0,0 +1,350 @@
+'''
+In-process LRU cache, and on-disk cache shared by processes.
+
+LRUCache implements the part of the Django cache API that ryzom uses, so
+that it can be swapped with a Django cache backend.
+
+DiskCache persists transpiled JS, bundles and compiled sass across
+restarts, it is enabled by setting the RYZOM_CACHE_DIR environment
+variable to a directory that workers can share.
+'''
+import collections
+import contextlib
+import functools
+import hashlib
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+# modules only some functions need are imported by them, to keep
+# import ryzom fast
+
+
+class LRUCache:
+    '''
+    Thread safe least recently used cache of maxsize entries.
+
+    Counts hits and misses, which are reset by clear().
+    '''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return (key, None) in self.data
+
+    def get(self, key, default=None, version=None):
+        key = (key, version)
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value, timeout=None, version=None):
+        key = (key, version)
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def add(self, key, value, timeout=None, version=None):
+        with self.lock:
+            if (key, version) in self.data:
+                return False
+        self.set(key, value, timeout, version)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        with self.lock:
+            if (key, version) not in self.data:
+                raise ValueError(f'Key {key} not found')
+            self.data[(key, version)] += delta
+            return self.data[(key, version)]
+
+    def delete(self, key, version=None):
+        with self.lock:
+            return self.data.pop((key, version), None) is not None
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = 0
+
+
+@functools.lru_cache()
+def ryzom_version():
+    import importlib.metadata
+    try:
+        return importlib.metadata.version('ryzom')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+class DiskCache:
+    '''
+    Content addressed cache of strings in a directory.
+
+    Keys are hashed together with the ryzom version, so that upgrading
+    invalidates everything. Writes are atomic, so that processes can
+    share the directory.
+    '''
+    def __init__(self, path, version=None):
+        self.path = path
+        self.version = version or ryzom_version()
+        self.hits = self.misses = 0
+
+    def filename(self, key):
+        digest = hashlib.sha256(
+            f'{self.version}\n{key}'.encode('utf8')
+        ).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def get(self, key, default=None):
+        try:
+            with open(self.filename(key), encoding='utf8') as f:
+                value = f.read()
+        except OSError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        '''
+        Store a value, if the directory can't be written to it is not kept
+        and get() will miss it, like on a cold cache.
+        '''
+        import tempfile
+        path = self.filename(key)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except OSError:
+            if tmp is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+
+    def clear(self):
+        import shutil
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.hits = self.misses = 0
+
+
+_disk_caches = dict()
+
+
+def disk_cache():
+    '''Return the DiskCache of RYZOM_CACHE_DIR, or None if not set.'''
+    path = os.environ.get('RYZOM_CACHE_DIR', None)
+    if not path:
+        return None
+    if path not in _disk_caches:
+        _disk_caches[path] = DiskCache(path)
+    return _disk_caches[path]
+
+
+_file_hashes = dict()
+
+
+def file_hash(path):
+    '''Return the sha256 of a file, cached until it changes.'''
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        with open(path, 'rb') as f:
+            _file_hashes[key] = hashlib.sha256(f.read()).hexdigest()
+    return _file_hashes[key]
+
+
+def module_files(module):
+    '''
+    Return the source files a bundle of module depends on.
+
+    That is the module file, and the files of the modules defining the
+    classes its classes inherit from.
+    '''
+    from ryzom.components import registered
+    importlib.import_module(module)
+    names = {module}
+    for value in registered(module):
+        names.update(cls.__module__ for cls in value.__mro__)
+    files = set()
+    for name in names:
+        path = getattr(sys.modules.get(name, None), '__file__', None)
+        if path and os.path.exists(path):
+            files.add(path)
+    return sorted(files)
+
+
+def bundle_files(*modules):
+    '''Return the source files that bundling modules depends on.'''
+    from py2js import transpiler
+    files = {transpiler.__file__}
+    for module in modules:
+        files.update(module_files(module))
+    return sorted(files)
+
+
+def fingerprint(*modules):
+    '''Return a hash of the sources that bundling modules depends on.'''
+    files = bundle_files(*modules)
+    return hashlib.sha256('\n'.join(
+        [*modules] + [f'{path}:{file_hash(path)}' for path in files]
+    ).encode('utf8')).hexdigest()
+
+
+def class_files(cls):
+    '''Return the source files of a class, its bases and the transpiler.'''
+    from py2js import transpiler
+    files = {transpiler.__file__}
+    for base in cls.__mro__:
+        path = getattr(sys.modules.get(base.__module__), '__file__', None)
+        if path and os.path.exists(path):
+            files.add(path)
+    return sorted(files)
+
+
+def class_fingerprint(cls):
+    '''Return a hash of the sources a class and its bases are defined in.'''
+    return hashlib.sha256('\n'.join(
+        [f'{cls.__module__}.{cls.__qualname__}']
+        + [f'{path}:{file_hash(path)}' for path in class_files(cls)]
+    ).encode('utf8')).hexdigest()
+
+
+pieces = dict()
+
+
+def cached_piece(kind, cls):
+    '''Return the piece of a class if its sources did not change, or None.'''
+    name = f'{cls.__module__}.{cls.__qualname__}'
+    fingerprint = class_fingerprint(cls)
+    if (cached := pieces.get((kind, name), None)) and cached[0] == fingerprint:
+        return cached[1]
+
+    disk = disk_cache()
+    if disk and (value := disk.get(f'{kind} piece {name} {fingerprint}')):
+        chunks = json.loads(value)
+        pieces[(kind, name)] = (fingerprint, chunks)
+        return chunks
+
+
+def store_piece(kind, cls, chunks):
+    '''Keep the piece of a class, return it.'''
+    name = f'{cls.__module__}.{cls.__qualname__}'
+    fingerprint = class_fingerprint(cls)
+    if disk := disk_cache():
+        disk.set(f'{kind} piece {name} {fingerprint}', json.dumps(chunks))
+    pieces[(kind, name)] = (fingerprint, chunks)
+    return chunks
+
+
+def timed(build, cls):
+    '''Return build(cls) and the seconds it took.'''
+    start = time.perf_counter()
+    return build(cls), time.perf_counter() - start
+
+
+def piece(kind, cls, build, report=None):
+    '''
+    Return the bundle piece of a class, built by build(cls) if its sources
+    changed since last time.
+
+    A piece is a list of [key, code] chunks that must be JSON serializable,
+    so that they can be kept on disk too. Append (name, seconds) to report
+    for pieces that are built.
+    '''
+    if (chunks := cached_piece(kind, cls)) is not None:
+        return chunks
+
+    chunks, seconds = timed(build, cls)
+    if report is not None:
+        report.append((f'{kind} {cls.__module__}.{cls.__qualname__}', seconds))
+    return store_piece(kind, cls, chunks)
+
+
+def importable(cls):
+    '''Return True if cls can be found by its module and qualified name.'''
+    value = sys.modules.get(cls.__module__, None)
+    for name in cls.__qualname__.split('.'):
+        value = getattr(value, name, None)
+    return value is cls
+
+
+def build_pieces(kind, classes, build, jobs, report=None):
+    '''
+    Build the stale pieces of classes in a pool of jobs processes, so that
+    piece() finds them.
+
+    Classes that can't be pickled by name, ie. defined in a function, are
+    left for piece() to build.
+    '''
+    stale = [
+        cls for cls in dict.fromkeys(classes)
+        if importable(cls) and cached_piece(kind, cls) is None
+    ]
+    if len(stale) < 2:
+        return
+
+    import concurrent.futures
+    import multiprocessing
+
+    # forked workers have the modules of the classes imported already
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context) as pool:
+        results = pool.map(timed, [build] * len(stale), stale)
+        for cls, (chunks, seconds) in zip(stale, results):
+            if report is not None:
+                report.append(
+                    (f'{kind} {cls.__module__}.{cls.__qualname__}', seconds))
+            store_piece(kind, cls, chunks)
+
+
+def stable_key(key):
+    '''
+    Return a str of a transpilation cache key that holds across processes.
+
+    Functions and classes are represented by their name and source hash,
+    returns None if something else than that, numbers or strings is found.
+    '''
+    import inspect
+    out = []
+    for item in key:
+        if isinstance(item, tuple):
+            item = stable_key(item)
+            if item is None:
+                return None
+        elif isinstance(item, (str, int, float, type(None))):
+            item = repr(item)
+        elif inspect.isroutine(item) or inspect.isclass(item):
+            name = f'{item.__module__}.{item.__qualname__}'
+            try:
+                from py2js.transpiler import getsource
+                source = getsource(item)
+            except (OSError, TypeError):
+                if not isinstance(item, type) or item.__module__ != 'builtins':
+                    return None
+                source = ''
+            digest = hashlib.sha256(source.encode('utf8')).hexdigest()
+            item = f'{name}:{digest}'
+        else:
+            return None
+        out.append(item)
+    return f'({", ".join(out)})'
@@ -3,18 +3,44 @@ Ryzom components declarations.
 There's still a lot of tags missing.
 They will be added when they'll be needed
 '''
-import copy
+import contextlib
+import contextvars
+import functools
 import importlib
 import textwrap
 import re
-import uuid
 
-from py2js.transpiler import transpile_body
+from ryzom import ids
 
-try:
-    from django.utils.safestring import mark_safe
-except ImportError:
-    mark_safe = lambda x: x
+
+# methods transpiled to functions the rendered attribute calls
+AUTOCOMPILE = (
+    'onclick',
+    'onmouseover',
+    'onsubmit',
+    'onchange',
+    'oninput',
+)
+
+# turn a CamelCase class name into a dashed tag name
+TAG_WORD_RE = re.compile('(.)([A-Z][a-z]+)')
+TAG_CASE_RE = re.compile('([a-z0-9])([A-Z])')
+
+_mark_safe = None
+
+
+def mark_safe(value):
+    '''
+    Return Django's mark_safe(value) if installed, imported on first use
+    because importing Django takes longer than importing ryzom.
+    '''
+    global _mark_safe
+    if _mark_safe is None:
+        try:
+            from django.utils.safestring import mark_safe as _mark_safe
+        except ImportError:
+            _mark_safe = lambda value: value
+    return _mark_safe(value)
 
 
 def component_html(path, *args, **kwargs):
@@ -60,6 +86,15 @@ class HTMLPayload(dict):
         for key, value in other.items():
             self[key] = value
 
+    def copy(self):
+        '''Return a copy, nested payloads (ie. style) are copied too.'''
+        result = type(self)()
+        for key, value in self.items():
+            if isinstance(value, HTMLPayload):
+                value = value.copy()
+            dict.__setitem__(result, key, value)
+        return result
+
 
 class CStyle(HTMLPayload):
     @classmethod
@@ -74,6 +109,21 @@ class CStyle(HTMLPayload):
 
 
 class CAttrs(HTMLPayload):
+    def __get__(self, component, cls=None):
+        '''
+        Copy class attrs into the instance on first access.
+
+        Instances share the attrs of their class until something asks for
+        self.attrs, which is what addcls, rmcls, style and __setitem__ do
+        before mutating them, so construction doesn't pay for a copy.
+        '''
+        if component is None:
+            return self
+        attrs = component.__dict__['attrs'] = self.copy()
+        # class defined style attribute is bundled
+        attrs.pop('style', None)
+        return attrs
+
     def __getitem__(self, name):
         if name == 'style' and 'style' not in self:
             # Create CStyle on the fly
@@ -150,6 +200,149 @@ def noclose(tag):
     ]
 
 
+class ClassList(list):
+    '''
+    Scripts or stylesheets of a component class.
+
+    Like CAttrs, instances get their own copy on first access only.
+    '''
+    def __set_name__(self, cls, name):
+        self.name = name
+
+    def __get__(self, component, cls=None):
+        if component is None:
+            return self
+        value = component.__dict__[self.name] = list(self)
+        return value
+
+
+class RenderPlan:
+    '''
+    Precomputed HTML pieces of a component class.
+
+    ComponentMetaclass builds one for every class, so that rendering an
+    instance only has to format what differs from its class: the ryzom-id,
+    the attributes if they were changed, and the content.
+
+    The plan keeps a copy of the class attrs it was built with, see
+    class_plan() which builds it again when they were changed.
+    '''
+    def __init__(self, tag, selfclose=False, attrs=None, js=True):
+        self.tag = tag
+        self.selfclose = selfclose
+        self.js = js
+        self.void = selfclose or (noclose(tag) if tag else False)
+        self.source = attrs.copy() if attrs else CAttrs()
+        self.attrs = self.source.copy()
+        # class defined style attribute is bundled
+        self.attrs.pop('style', None)
+        self.prefix = f'<{tag} '
+        self.opening = f'{self.prefix}{self.attrs.to_html()} ryzom-id="'
+        self.end = '"/>' if selfclose else '">'
+        self.closing = f'</{tag}>'
+
+
+def class_plan(cls):
+    '''
+    Return the RenderPlan of a component class, built again if the class
+    attrs were changed since, ie. by Foo.attrs['a'] = 'b'.
+    '''
+    plan = cls.render_plan
+    if cls.attrs != plan.source:
+        plan = cls.render_plan = RenderPlan(
+            plan.tag, plan.selfclose, cls.attrs, plan.js)
+    return plan
+
+
+@functools.lru_cache()
+def render_plan(tag, selfclose=False):
+    '''Return the RenderPlan for instances which override tag/selfclose.'''
+    return RenderPlan(tag, selfclose)
+
+
+_recording = contextvars.ContextVar('ryzom_recording', default=None)
+
+
+@contextlib.contextmanager
+def recording():
+    '''Yield the set of component classes instanciated within the block.'''
+    classes = set()
+    token = _recording.set(classes)
+    try:
+        yield classes
+    finally:
+        _recording.reset(token)
+
+
+def record(*classes):
+    '''Add classes to the current recording, if any.'''
+    if (recorded := _recording.get()) is not None:
+        recorded.update(classes)
+
+
+def component_classes(*components):
+    '''Return the classes of components and of their descendants.'''
+    classes = set()
+    stack = list(components)
+    while stack:
+        component = stack.pop()
+        classes.add(type(component))
+        if isinstance(content := getattr(component, 'content', None), list):
+            stack.extend(content)
+    return classes
+
+
+_streams = dict()
+
+
+def streams(cls):
+    '''Return True if cls renders with iter_html().
+
+    A class that overrides to_html() without overriding iter_html() renders
+    in a single chunk with its to_html(), so that its customizations apply.
+    '''
+    if cls not in _streams:
+        for klass in cls.__mro__:
+            if 'iter_html' in klass.__dict__:
+                _streams[cls] = True
+                break
+            if 'to_html' in klass.__dict__:
+                _streams[cls] = False
+                break
+        else:
+            _streams[cls] = False
+    return _streams[cls]
+
+
+def html_chunks(component, *content, **context):
+    '''Yield the HTML of anything that quacks like a component.'''
+    if getattr(component, 'tag', None) != 'text' and streams(type(component)):
+        yield from component.iter_html(*content, **context)
+    else:
+        yield component.to_html(*content, **context)
+
+
+def registered(*modules, js=False, css=False):
+    '''
+    Return the component classes in the namespace of modules, in order.
+
+    Classes that modules import count as well as those they define, so
+    that a module which re-exports components, ie. with a star import,
+    bundles them. Pass js or css to only return classes that might
+    contribute to that bundle.
+    '''
+    classes = dict()
+    for module in modules:
+        for value in list(vars(importlib.import_module(module)).values()):
+            if (
+                isinstance(value, ComponentMetaclass)
+                and (value.bundle_js or not js)
+                and (value.bundle_css or not css)
+            ):
+                classes[value] = None
+    return list(classes)
+
+
 class ComponentMetaclass(type):
     def __new__(cls, name, bases, class_attrs):
         attrs = CAttrs()
@@ -167,7 +360,8 @@ class ComponentMetaclass(type):
         if class_attrs.get('attrs', None):
             attrs.update(class_attrs['attrs'])
         if 'style' in class_attrs:
-            attrs.update(dict(style=class_attrs['style']))
+            # consumed here, instances get it from attrs.style
+            attrs.update(dict(style=class_attrs.pop('style')))
         if attrs.get('style', None) or class_attrs.get('sass', None):
             if not attrs.get('class', ''):
                 attrs['class'] = name
@@ -177,11 +371,11 @@ class ComponentMetaclass(type):
 
         if extra_stylesheets := class_attrs.get('stylesheets', None):
             stylesheets.extend(extra_stylesheets)
-        class_attrs['stylesheets'] = stylesheets
+        class_attrs['stylesheets'] = ClassList(stylesheets)
 
         if extra_scripts := class_attrs.get('scripts', None):
             scripts.extend(extra_scripts)
-        class_attrs['scripts'] = scripts
+        class_attrs['scripts'] = ClassList(scripts)
 
         if 'tag' not in class_attrs:
             tag = None
@@ -193,8 +387,8 @@ class ComponentMetaclass(type):
                         break
 
             if not tag:
-                s1 = re.sub('(.)([A-Z][a-z]+)', r'\1-\2', name)
-                tag = re.sub('([a-z0-9])([A-Z])', r'\1-\2', s1).lower()
+                s1 = TAG_WORD_RE.sub(r'\1-\2', name)
+                tag = TAG_CASE_RE.sub(r'\1-\2', s1).lower()
 
             class_attrs['tag'] = tag
 
@@ -206,10 +400,31 @@ class ComponentMetaclass(type):
 
         cls = super().__new__(cls, name, bases, class_attrs)
 
-        from ryzom.bundle.js import AUTOCOMPILE
-        for method in AUTOCOMPILE:
-            if getattr(cls, method, None):
-                class_attrs['attrs'][method] = f'{name}_{method}(this)'
+        methods = [method for method in AUTOCOMPILE if getattr(cls, method, None)]
+        for method in methods:
+            class_attrs['attrs'][method] = f'{name}_{method}(this)'
+
+        # what the class might contribute to bundles, set on each class
+        # because they are computed with inherited attributes
+        cls.bundle_js = bool(
+            methods or class_attrs['HTMLElement']
+            or callable(getattr(cls, 'py2js', None))
+        )
+        cls.bundle_css = bool(
+            getattr(cls, 'sass', None) or 'style' in class_attrs['attrs']
+        )
+
+        # skip render_js() unless there might be something to render,
+        # instance py2js is checked at render time
+        base = globals().get('Component', None)
+        cls.render_plan = RenderPlan(
+            cls.tag,
+            getattr(cls, 'selfclose', False),
+            cls.attrs,
+            js=hasattr(cls, 'py2js') or (
+                base is not None and cls.render_js is not base.render_js
+            ),
+        )
 
         return cls
 
@@ -242,19 +457,13 @@ class Component(metaclass=ComponentMetaclass):
     '''
 
     tag = None  # make sure this class is tagless
+    selfclose = False
     __publication = None
 
-    def __getattribute__(self, name):
+    def __getattr__(self, name):
         '''Bind style to attrs.style'''
         if name == 'style':
             return self.attrs.style
-        return super().__getattribute__(name)
-
-    def __getattr__(self, name):
-        '''Instanciate attrs on the fly.'''
-        if name == 'attrs':
-            self.attrs = CAttrs()
-            return self.attrs
         raise AttributeError(f'{self} object has no attribute {name}')
 
     def __call__(self, *content, **slots):
@@ -278,36 +487,27 @@ class Component(metaclass=ComponentMetaclass):
                 value.attrs.setdefault('slot', key)
             self.content.append(attrs.pop(key))
 
-        self.id = attrs.get('id', uuid.uuid1().hex)
+        self.id = attrs['id'] if 'id' in attrs else ids.next_id()
         self.parent = attrs.pop('parent', None)
 
         if 'tag' in attrs:
             self.__dict__['tag'] = attrs.pop('tag')
             self.__dict__['noclose'] = noclose(self.tag)
 
-        self.__dict__['selfclose'] = attrs.pop(
-            'selfclose',
-            getattr(self, 'selfclose', False),
-        )
-
-        self.scripts = copy.deepcopy(getattr(self, 'scripts', []))
-        self.stylesheets = copy.deepcopy(getattr(self, 'stylesheets', []))
+        if 'selfclose' in attrs:
+            self.__dict__['selfclose'] = attrs.pop('selfclose')
 
         self.events = attrs.pop('events', {})
 
-        class_attrs = copy.deepcopy(getattr(self, 'attrs', {}))
-        # remove class defined style attribute because it is bundled
-        if 'style' in class_attrs:
-            class_attrs.pop('style')
-
-        # create an instance attribute from the class attribute
-        self.__dict__['attrs'] = class_attrs
-
-        # update with kwargs
-        self.attrs.update(attrs)
+        # class attrs, scripts and stylesheets are copied on first access
+        if attrs:
+            self.attrs.update(attrs)
 
         self.position = 0
 
+        if (recorded := _recording.get()) is not None:
+            recorded.add(cls)
+
         self.preparecontent()
 
     def __eq__(self, other):
@@ -333,7 +533,8 @@ class Component(metaclass=ComponentMetaclass):
                 continue
 
             if not hasattr(c, 'to_html'):
-                self.content[i] = c = Text(str(c))
+                self.content[i] = c = TextNode(str(c), self, i)
+                continue
 
             c.parent = self
             c.position = i
@@ -381,38 +582,52 @@ class Component(metaclass=ComponentMetaclass):
         This methods returns a dict representation of the current
         instance. I handles subscriptions that will have this component
         instance id as parent attribute.
-        Recursively sets the content as dict too (maybe recursiveness is not
-        a good thing to do without any control of how deep can the tree be,
-        there's a risk of stack overflow that we must keep in mind)
+        The content is serialized in the same pass with an explicit stack,
+        so that deep trees can't overflow the Python stack. Components
+        which override to_obj() are trusted to serialize themselves.
 
         :returns: A serializable representation of the instance
         '''
-        if self.tag == 'text':
-            content = self.content
-        else:
-            content = []
-            for c in self.content:
-                if not c:
-                    continue
-                if isinstance(c, (int, float, str)):
-                    content.append(c)
-                else:
-                    content.append(c.to_obj())
-
-        if isinstance(self.parent, str):
-            parent_id = self.parent
-        else:
-            parent_id = self.parent.id
+        result = []
+        stack = [(self, result)]
+        while stack:
+            component, out = stack.pop()
+            if isinstance(component, (int, float, str)):
+                out.append(component)
+                continue
+            if component is not self and (
+                type(component).to_obj is not Component.to_obj
+            ):
+                out.append(component.to_obj())
+                continue
 
-        return {
-            'id': self.id,
-            'tag': self.tag,
-            'content': content,
-            'parent': parent_id,
-            'position': self.position,
-            'script': self.render_js(),
-            'attrs': self.attrs
-        }
+            parent = component.parent
+            if parent is not None and not isinstance(parent, str):
+                parent = parent.id
+
+            plan = class_plan(type(component))
+            attrs = component.__dict__.get('attrs', None)
+            obj = {
+                'id': component.id,
+                'tag': component.tag,
+                'content': component.content,
+                'parent': parent,
+                'position': component.position,
+                'script': component.render_js() if (
+                    plan.js or 'py2js' in component.__dict__) else '',
+                # a copy, so that callers can't change the class attrs
+                'attrs': plan.attrs.copy() if attrs is None else attrs,
+            }
+            out.append(obj)
+
+            if component.tag != 'text':
+                obj['content'] = []
+                stack.extend(
+                    (c, obj['content'])
+                    for c in reversed(component.content)
+                    if c
+                )
+        return result[0]
 
     @property
     def publication(self):
@@ -423,15 +638,17 @@ class Component(metaclass=ComponentMetaclass):
         self.__publication = value
 
     def content_html(self, *content, **context):
-        html = ''
+        return ''.join(self.iter_content_html(*content, **context))
+
+    def iter_content_html(self, *content, **context):
+        '''Yield the inner HTML chunk by chunk.'''
         for c in content:
             if hasattr(c, 'to_html'):
-                newline = '' if getattr(c, 'tag', None) == 'text' else '\n'
-                html += newline + c.to_html(**context)
+                if getattr(c, 'tag', None) != 'text':
+                    yield '\n'
+                yield from html_chunks(c, **context)
             else:
-                html += str(c)
-
-        return html
+                yield str(c)
 
     def context(self, *content, **context):
         for c in (content or self.content):
@@ -442,23 +659,39 @@ class Component(metaclass=ComponentMetaclass):
     def to_html(self, *content, attrs=None, **context):
         if self.tag == 'text':
             return f'{self.content}'
+        return ''.join(self.iter_html(*content, attrs=attrs, **context))
+
+    def iter_html(self, *content, attrs=None, **context):
+        '''Yield the outer and inner HTML chunk by chunk.
+
+        This is what to_html() joins, use it directly to stream big pages
+        instead of building them in memory.
+        '''
+        if self.tag == 'text':
+            yield self.to_html(**context)
+            return
 
-        attrs = ' '.join([
-            (attrs or self.attrs).to_html(),
-            f'ryzom-id="{self.id}"'
-        ])
-        html = ''
+        own = self.__dict__.get('attrs', None)
+        plan = class_plan(type(self))
+        if plan.tag != self.tag or plan.selfclose != self.selfclose:
+            plan = render_plan(self.tag, self.selfclose)
+            own = self.attrs
 
-        if getattr(self, 'selfclose', False):
-            html = f'<{self.tag} {attrs}/>'
-        elif getattr(self, 'noclose', False):
-            html = f'<{self.tag} {attrs}>'
+        if attrs is None and (own is None or own == plan.attrs):
+            yield f'{plan.opening}{self.id}{plan.end}'
         else:
-            html = f'<{self.tag} {attrs}>'
+            attrs = (attrs or self.attrs).to_html()
+            yield f'{plan.prefix}{attrs} ryzom-id="{self.id}{plan.end}'
+
+        if not plan.void:
             content = content or self.content
-            html += self.content_html(*content, **context)
-            if render_js_str := self.render_js():
-                html += '\n'.join([
+            if type(self).content_html is Component.content_html:
+                yield from self.iter_content_html(*content, **context)
+            else:
+                yield self.content_html(*content, **context)
+            if (plan.js or 'py2js' in self.__dict__) and (
+                    render_js_str := self.render_js()):
+                yield '\n'.join([
                     '\n<script type="text/javascript">',
                     render_js_str.strip(),
                     '</script>',
@@ -467,9 +700,7 @@ class Component(metaclass=ComponentMetaclass):
                 newline = '\n'
             else:
                 newline = ''
-            html += f'{newline}</{self.tag}>'
-
-        return html
+            yield f'{newline}{plan.closing}'
 
     def render(self, *content, **context):
         if 'view' in context:
@@ -478,8 +709,28 @@ class Component(metaclass=ComponentMetaclass):
         context = self.context(*content, **context)
         return self.to_html(*content, **context)
 
+    def iter_render(self, *content, **context):
+        '''Like render(), but yield the HTML chunk by chunk.'''
+        if 'view' in context:
+            self.view = context['view']
+        content = content or self.content
+        context = self.context(*content, **context)
+        return html_chunks(self, *content, **context)
+
+    def cache_key(self):
+        '''Return the key to cache the HTML of this component with, or None.
+
+        Used by ryzom_django.cache.CachedFragment, which keys by class too:
+        return something that covers everything rendering depends on, ie.
+        the user, or None to not cache. Make it a classmethod if it doesn't
+        depend on the instance, so that CachedFragment of a class only
+        instanciates it on cache misses.
+        '''
+        return None
+
     def render_js(self):
         if hasattr(self, 'py2js'):
+            from py2js.transpiler import transpile_body
             return mark_safe(transpile_body(self.py2js, self=self))
         return ''
 
@@ -513,6 +764,11 @@ class CList(Component):
     def to_html(self, **kwargs):
         return self.content_html(*self.content, **kwargs)
 
+    def iter_html(self, **kwargs):
+        if type(self).content_html is Component.content_html:
+            return self.iter_content_html(*self.content, **kwargs)
+        return iter([self.content_html(*self.content, **kwargs)])
+
     def to_obj(self, context=None):
         content = [
             c.to_obj(context)
@@ -533,6 +789,65 @@ class Text(Component):
         self.content = self.content[0]
 
 
+class TextNode:
+    '''
+    Text node that preparecontent() wraps strings and numbers with.
+
+    Quacks like a Text component, but with slots only: no attrs, events,
+    scripts nor stylesheets, and the id is only generated if asked for,
+    because tables are mostly made of text nodes.
+    '''
+    __slots__ = ('content', 'parent', 'position', '_id')
+    tag = 'text'
+
+    def __init__(self, content, parent=None, position=0):
+        self.content = content
+        self.parent = parent
+        self.position = position
+        self._id = None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = ids.next_id()
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        self._id = value
+
+    @property
+    def attrs(self):
+        return CAttrs()
+
+    def __eq__(self, other):
+        return (
+            getattr(other, 'tag', None) == 'text'
+            and self.content == other.content
+        )
+
+    def __repr__(self):
+        return f'<TextNode {self.content!r}>'
+
+    def to_html(self, *content, **context):
+        return f'{self.content}'
+
+    def render_js(self):
+        return ''
+
+    def to_obj(self, context=None):
+        parent = self.parent
+        return {
+            'id': self.id,
+            'tag': self.tag,
+            'content': self.content,
+            'parent': parent if isinstance(parent, str) else parent.id,
+            'position': self.position,
+            'script': '',
+            'attrs': self.attrs,
+        }
+
+
 class Markdown(Text):
     def __init__(self, *content, **kwargs):
         self.kwargs = kwargs
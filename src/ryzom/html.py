@@ -1,10 +1,9 @@
-from ryzom.components import CList, Component, CTree, HTMLPayload, Markdown, Text
-from py2js.transpiler import transpile_body
+import copy
+import threading
 
-try:
-    from django.utils.safestring import mark_safe
-except ImportError:
-    mark_safe = lambda x: x
+from ryzom.components import (
+    CList, Component, CTree, HTMLPayload, Markdown, Text, mark_safe,
+)
 
 templates = dict()
 
@@ -39,20 +38,36 @@ BASIC_TAGS = (
     'time', 'title', 'tr', 'tt', 'u', 'ul', 'var', 'video', 'xmp',
 )
 
-for tag in BASIC_TAGS:
-    locals()[tag.capitalize()] = type(tag.capitalize(), (Component,), {'tag': tag})
-
 SELFCLOSE_TAGS = (
     'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'link', 'meta',
     'param', 'source', 'track', 'wbr',
 )
 
-for tag in SELFCLOSE_TAGS:
-    locals()[tag.capitalize()] = type(
-        tag.capitalize(),
-        (Component,),
-        {'tag': tag, 'selfclose': True},
-    )
+# tag classes are created on first access by __getattr__, to import faster
+_tags = {tag.capitalize(): (tag, False) for tag in BASIC_TAGS}
+_tags.update({tag.capitalize(): (tag, True) for tag in SELFCLOSE_TAGS})
+
+
+_tags_lock = threading.Lock()
+
+
+def __getattr__(name):
+    if name not in _tags:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    # threads must get the same class, for isinstance and the bundles
+    with _tags_lock:
+        if name not in globals():
+            tag, selfclose = _tags[name]
+            attrs = {'tag': tag}
+            if selfclose:
+                attrs['selfclose'] = True
+            globals()[name] = type(name, (Component,), attrs)
+    return globals()[name]
+
+
+# used in this module
+Body, Link, Meta, Title = (
+    __getattr__(name) for name in ('Body', 'Link', 'Meta', 'Title'))
 
 
 class Form(Component):
@@ -119,7 +134,8 @@ class Html(Component):
                 continue
 
             if hasattr(src, 'to_html'):
-                self.head.content.append(src)
+                # components are shared with the class, don't reparent them
+                self.head.content.append(copy.deepcopy(src))
             else:
                 self.head.content.append(Stylesheet(href=src))
 
@@ -128,8 +144,9 @@ class Html(Component):
                 continue
 
             if hasattr(src, 'to_html'):
-                self.head.content.append(src)
+                self.head.content.append(copy.deepcopy(src))
             elif callable(src):
+                from py2js.transpiler import transpile_body
                 self.head.content.append(
                     Script(mark_safe(transpile_body(src)))
                 )
@@ -139,3 +156,11 @@ class Html(Component):
         if title := getattr(self, 'title', None):
             self.__dict__['title'] = Title(title)
             self.head.addchild(self.title)
+
+
+# from ryzom.html import * creates all tag classes, so modules that star
+# import it don't benefit from the lazy creation
+__all__ = [
+    name for name in dict.fromkeys([*globals(), *_tags])
+    if not name.startswith('_')
+]
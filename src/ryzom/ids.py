@@ -0,0 +1,100 @@
+'''
+Generate the ryzom-id of components.
+
+Every component gets an id when it is instanciated. Ids end up in the
+ryzom-id attribute, DDP messages and subscription registrations in the
+database, so the default generator must stay unique across processes: it
+counts in base 62 after a random prefix which is drawn again after a fork.
+
+Swap the generator for a block of code, ie. to render stable fixtures:
+
+.. code-block:: python
+
+    from ryzom import ids
+
+    with ids.generator(ids.Counter('t')):
+        html = Div('a', Div('b')).render()  # ryzom-id="t0", "t1" ...
+
+Any callable returning a str will do, ie. to restore uuids:
+
+.. code-block:: python
+
+    ids.default = lambda: uuid.uuid1().hex
+'''
+import contextlib
+import contextvars
+import itertools
+import os
+import string
+
+
+ALPHABET = string.digits + string.ascii_letters
+PREFIX_LENGTH = 8
+
+
+def base62(number):
+    '''Return number encoded in base 62.'''
+    if not number:
+        return ALPHABET[0]
+    out = []
+    while number:
+        number, rest = divmod(number, 62)
+        out.append(ALPHABET[rest])
+    return ''.join(reversed(out))
+
+
+def random_prefix(length=PREFIX_LENGTH):
+    '''Return a random base 62 string.'''
+    return ''.join(ALPHABET[byte % 62] for byte in os.urandom(length))
+
+
+class Counter:
+    '''
+    Monotonic id generator: prefix followed by a base 62 counter.
+
+    Without prefix, a random one is generated.
+    '''
+    def __init__(self, prefix=None):
+        self.prefix = random_prefix() if prefix is None else prefix
+        self.count = itertools.count()
+
+    def __call__(self):
+        return self.prefix + base62(next(self.count))
+
+
+default = Counter()
+_generator = contextvars.ContextVar('ryzom_id_generator', default=None)
+
+
+def _reset_default():
+    global default
+    if isinstance(default, Counter):
+        default = Counter()
+
+
+if hasattr(os, 'register_at_fork'):
+    # forked workers would generate the same ids as their parent
+    os.register_at_fork(after_in_child=_reset_default)
+
+
+def next_id():
+    '''Return a new id from the current generator.'''
+    return (_generator.get() or default)()
+
+
+@contextlib.contextmanager
+def generator(generator):
+    '''Use generator for components instanciated within the block.'''
+    token = _generator.set(generator)
+    try:
+        yield generator
+    finally:
+        _generator.reset(token)
+
+
+def prefixes():
+    '''Return the prefixes of the current generators, used by tests.'''
+    return [
+        gen.prefix for gen in (_generator.get(), default)
+        if isinstance(gen, Counter)
+    ]
@@ -0,0 +1,215 @@
+'''
+Time rendering per component class.
+
+.. code-block:: python
+
+    from ryzom.profiler import profile
+
+    with profile() as profiler:
+        html = page.render()
+
+    profiler.as_dict()    # {'ryzom.html.Div': {'count': 3, 'self': ...}}
+    profiler.collapsed()  # folded stacks for flamegraph.pl or speedscope
+
+Rendering methods are only instrumented within the block: to_html, render,
+to_obj and render_js of component classes, the rendering of children, and
+py2js transpilation which is recorded as the py2js frame. Other threads
+render as usual meanwhile.
+'''
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+from ryzom import components
+
+
+METHODS = ('to_html', 'render', 'to_obj', 'render_js')
+PY2JS = 'py2js'
+
+_current = contextvars.ContextVar('ryzom_profiler', default=None)
+_lock = threading.Lock()
+_active = 0
+_patches = []
+
+
+def class_name(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+class Profiler:
+    '''
+    Instance count, self time and cumulative time per component class.
+
+    Self time is what is spent in a component and not in its children, the
+    cumulative time of a class does not count it twice when it renders
+    instances of itself.
+    '''
+    def __init__(self):
+        self.stats = collections.defaultdict(
+            lambda: dict(count=0, self=0.0, cumulative=0.0))
+        self.stacks = collections.Counter()
+        self.stack = []
+        self.seen = set()
+        self.last = None
+
+    def charge(self, now):
+        '''Add the time since the last event to the frame on top.'''
+        if self.stack:
+            elapsed = now - self.last
+            self.stats[self.stack[-1][0]]['self'] += elapsed
+            self.stacks[';'.join(name for name, key in self.stack)] += elapsed
+        self.last = now
+
+    @contextlib.contextmanager
+    def frame(self, name, key=None):
+        '''
+        Time a block as name. Instances are counted once by key, nested
+        frames of the same key are merged.
+        '''
+        if key is not None and self.stack and self.stack[-1][1] == key:
+            yield
+            return
+
+        if key is None or key not in self.seen:
+            self.stats[name]['count'] += 1
+            if key is not None:
+                self.seen.add(key)
+
+        start = time.perf_counter()
+        self.charge(start)
+        self.stack.append((name, key))
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.charge(end)
+            self.stack.pop()
+            if all(frame[0] != name for frame in self.stack):
+                self.stats[name]['cumulative'] += end - start
+
+    def as_dict(self):
+        '''Return the stats by name, most self time first.'''
+        return dict(sorted(
+            ((name, dict(stats)) for name, stats in self.stats.items()),
+            key=lambda item: -item[1]['self'],
+        ))
+
+    def collapsed(self):
+        '''Return folded stacks with self time in microseconds.'''
+        return '\n'.join(
+            f'{stack} {round(seconds * 1e6)}'
+            for stack, seconds in sorted(self.stacks.items())
+        )
+
+
+def current():
+    '''Return the profiler of the current context, if any.'''
+    return _current.get()
+
+
+@contextlib.contextmanager
+def frame(name, key=None):
+    '''Time a block in the current profiler if any, see Profiler.frame().'''
+    profiler = _current.get()
+    if profiler is None:
+        yield
+    else:
+        with profiler.frame(name, key):
+            yield
+
+
+def _method(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        profiler = _current.get()
+        if profiler is None:
+            return func(self, *args, **kwargs)
+        with profiler.frame(class_name(type(self)), id(self)):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _html_chunks(func):
+    @functools.wraps(func)
+    def wrapper(component, *content, **context):
+        profiler = _current.get()
+        if profiler is None or getattr(component, 'tag', None) == 'text':
+            yield from func(component, *content, **context)
+            return
+
+        # time each step, children are timed within their parent's steps
+        chunks = func(component, *content, **context)
+        name = class_name(type(component))
+        while True:
+            with profiler.frame(name, id(component)):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+            yield chunk
+    return wrapper
+
+
+def _py2js(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _current.get()
+        if profiler is None:
+            return func(*args, **kwargs)
+        with profiler.frame(PY2JS):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _subclasses(cls):
+    stack, seen = [cls], set()
+    while stack:
+        cls = stack.pop()
+        if cls not in seen:
+            seen.add(cls)
+            stack.extend(cls.__subclasses__())
+    return seen
+
+
+def _install():
+    from py2js import transpiler
+
+    _patches.append((components, 'html_chunks', components.html_chunks))
+    components.html_chunks = _html_chunks(components.html_chunks)
+    _patches.append((transpiler, 'convert_py2js', transpiler.convert_py2js))
+    transpiler.convert_py2js = _py2js(transpiler.convert_py2js)
+
+    for cls in _subclasses(components.Component):
+        for method in METHODS:
+            if method in cls.__dict__:
+                _patches.append((cls, method, cls.__dict__[method]))
+                setattr(cls, method, _method(cls.__dict__[method]))
+
+
+def _uninstall():
+    while _patches:
+        obj, name, value = _patches.pop()
+        setattr(obj, name, value)
+
+
+@contextlib.contextmanager
+def profile(profiler=None):
+    '''Yield a Profiler that times rendering within the block.'''
+    global _active
+    profiler = profiler or Profiler()
+    with _lock:
+        if not _active:
+            _install()
+        _active += 1
+    token = _current.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current.reset(token)
+        with _lock:
+            _active -= 1
+            if not _active:
+                _uninstall()
@@ -1,75 +1,356 @@
+import base64
+import functools
+import gzip
+import hashlib
 import importlib
+import importlib.util
+import json
+import os
+import re
 import sys
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from django import http
+from django.apps import apps
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.views import generic
-from django.urls import include, path, reverse_lazy
+from django.urls import include, path, reverse, reverse_lazy
 
 from ryzom import bundle
 from ryzom import html
+from ryzom.bundle.css import components as css_components
+from ryzom.bundle.js import components as js_components
+from ryzom.cache import (
+    LRUCache, bundle_files, class_files, class_fingerprint, fingerprint,
+)
+from ryzom.components import ComponentMetaclass, registered
+
+
+STATIC_PATH = os.path.join(os.path.dirname(__file__), 'static')
+HASHED_RE = re.compile(r'^bundle\.[0-9a-f]{12}\.(js|css)(\.gz|\.br)?$')
+
+
+@functools.lru_cache()
+def manifest(static_path=STATIC_PATH):
+    '''Return the manifest written by ryzom_bundle, empty if none.'''
+    try:
+        with open(os.path.join(static_path, 'bundle.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def bundle_url(name):
+    return staticfiles_storage.url(manifest().get(name, name))
+
+
+def pages():
+    '''Return True if bundles are split per page, see RYZOM_BUNDLE_PAGES.'''
+    return getattr(settings, 'RYZOM_BUNDLE_PAGES', False)
+
+
+def class_name(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def class_order(cls):
+    '''Sort bases first, so that subclass styles win.'''
+    return (len(cls.__mro__), class_name(cls))
+
+
+@functools.lru_cache()
+def known_classes():
+    '''
+    Return the component classes of get_component_modules() and their
+    bases by name, page bundles can only contain those.
+    '''
+    classes = dict()
+    for value in registered(*get_component_modules()):
+        for cls in value.__mro__:
+            if isinstance(cls, ComponentMetaclass):
+                classes[class_name(cls)] = cls
+    return classes
+
+
+@functools.lru_cache()
+def code_classes(kind):
+    '''
+    Return the known classes which have code of a bundle kind, js or css,
+    by their index in page urls, and a version of that index.
+
+    The bundle_js and bundle_css flags of classes tell, so that nothing is
+    built to know: some may have no code in the end, ie. a py2js that only
+    renders inline, which costs a bit in the url.
+    '''
+    classes = sorted(
+        (
+            cls for cls in known_classes().values()
+            if getattr(cls, f'bundle_{kind}', False)
+        ),
+        key=class_name,
+    )
+    version = hashlib.sha256(
+        ' '.join(class_name(cls) for cls in classes).encode('utf8')
+    ).hexdigest()[:8]
+    return {cls: i for i, cls in enumerate(classes)}, version
+
+
+def page_classes(classes, kind):
+    '''Return the known classes and bases of classes that have code.'''
+    index = code_classes(kind)[0]
+    result = set()
+    for cls in classes:
+        for base in getattr(cls, '__mro__', ()):
+            if base in index:
+                result.add(base)
+    return sorted(result, key=class_order)
+
+
+def page_url(name, classes, kind):
+    '''
+    Return the url of the bundle view for classes.
+
+    Only the classes that have code of the bundle kind are in the url, so
+    that pages which differ by the others share the same bundle. They are
+    a bitmap of their index in code_classes(), which is versioned.
+    '''
+    index, version = code_classes(kind)
+    bits = 0
+    for cls in page_classes(classes, kind):
+        bits |= 1 << index[cls]
+    key = base64.urlsafe_b64encode(
+        bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    ).rstrip(b'=').decode('ascii')
+    return f'{reverse(name)}?v={version}&c={key}'
+
+
+def page_query(request, kind):
+    '''
+    Return the classes of the c query parameter, None if it can't be read
+    or was made for other classes, ie. by another deployment.
+    '''
+    index, version = code_classes(kind)
+    key = request.GET['c']
+    if request.GET.get('v', None) != version:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(key + '=' * (-len(key) % 4))
+    except ValueError:
+        return None
+    bits = int.from_bytes(data, 'little')
+    return sorted(
+        (cls for cls, i in index.items() if bits >> i & 1),
+        key=class_order,
+    )
 
 
 class CSSBundle(html.Stylesheet):
     def to_html(self, *content, **context):
-        if settings.DEBUG:
+        if pages() and (classes := context.get('bundle_classes')) is not None:
+            self.attrs.href = page_url('bundle_css', classes, 'css')
+        elif settings.DEBUG:
             self.attrs.href = reverse_lazy('bundle_css')
         else:
-            self.attrs.href = staticfiles_storage.url('bundle.css')
+            self.attrs.href = bundle_url('bundle.css')
         return super().to_html(*content, **context)
 
 
 class JSBundle(html.Script):
     def to_html(self, *content, **context):
-        if settings.DEBUG:
+        if pages() and (classes := context.get('bundle_classes')) is not None:
+            self.attrs.src = page_url('bundle_js', classes, 'js')
+        elif settings.DEBUG:
             self.attrs.src = reverse_lazy('bundle_js')
         else:
-            self.attrs.src = staticfiles_storage.url('bundle.js')
+            self.attrs.src = bundle_url('bundle.js')
         return super().to_html(*content, **context)
 
 
+COMPONENT_SUBMODULES = ('views', 'urls', 'components', 'html')
+
+
+@functools.lru_cache()
 def get_component_modules():
+    '''
+    Return the modules of apps which define components, once per process.
+
+    The RYZOM_COMPONENT_MODULES setting may list them all, or an app may
+    declare its own with a ryzom_modules attribute on its AppConfig.
+    Otherwise, the RYZOM_COMPONENT_SUBMODULES of each app that exist are
+    imported, COMPONENT_SUBMODULES by default, and those which are missing
+    are not probed again.
+    '''
+    modules = getattr(settings, 'RYZOM_COMPONENT_MODULES', None)
+    if modules is not None:
+        for name in modules:
+            importlib.import_module(name)
+        return list(modules)
+
+    submodules = getattr(
+        settings, 'RYZOM_COMPONENT_SUBMODULES', COMPONENT_SUBMODULES)
     names = []
-    for app in settings.INSTALLED_APPS:
-        for subname in ('views', 'urls', 'components', 'html'):
-            name = '.'.join([app, subname])
+    for config in apps.get_app_configs():
+        declared = getattr(config, 'ryzom_modules', None)
+        if declared is not None:
+            for name in declared:
+                importlib.import_module(name)
+            names += [name for name in declared if registered(name)]
+            continue
+
+        for subname in submodules:
+            name = f'{config.name}.{subname}'
             try:
+                # find_spec doesn't execute anything, missing modules are
+                # only probed once per process thanks to the cache
+                if not importlib.util.find_spec(name):
+                    continue
                 importlib.import_module(name)
             except ImportError:
                 continue
-            names.append(name)
+            if registered(name):
+                names.append(name)
     return names
 
 
-def js():
-    return bundle.js(*get_component_modules())
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    if setting in ('INSTALLED_APPS', 'RYZOM_COMPONENT_MODULES',
+                   'RYZOM_COMPONENT_SUBMODULES'):
+        get_component_modules.cache_clear()
+        known_classes.cache_clear()
+        code_classes.cache_clear()
 
 
-def css():
-    return bundle.css(*get_component_modules())
+def js(report=None, jobs=None):
+    return bundle.js(*get_component_modules(), report=report, jobs=jobs)
 
 
-class CSSBundleView(generic.View):
-    def get(self, *args, **kwargs):
-        response = http.HttpResponse(css())
-        response['Content-Type'] = 'text/css'
-        return response
+def css(report=None, jobs=None):
+    return bundle.css(*get_component_modules(), report=report, jobs=jobs)
 
-    @classmethod
-    def as_url(cls):
-        return path('bundle.css', cls.as_view(), name='bundle_css')
 
+def minify(code):
+    '''Strip indentation and blank lines, keep newlines for JS ASI.'''
+    return '\n'.join(line.strip() for line in code.split('\n') if line.strip())
+
+
+def write(static_path=None, report=None, jobs=None):
+    '''
+    Write bundles with content hashed names, precompressed siblings and the
+    bundle.json manifest that maps bundle.js/css to them, in STATIC_PATH by
+    default.
+
+    bundle.js and bundle.css are written too, previous hashed files are
+    removed. Build in jobs processes if any. Return the manifest.
+    '''
+    static_path = static_path or STATIC_PATH
+    os.makedirs(static_path, exist_ok=True)
+    for name in os.listdir(static_path):
+        if HASHED_RE.match(name):
+            os.unlink(os.path.join(static_path, name))
+
+    result = dict()
+    codes = (('bundle.js', js(report, jobs)), ('bundle.css', css(report, jobs)))
+    for name, code in codes:
+        data = minify(code).encode('utf8')
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, ext = os.path.splitext(name)
+        result[name] = f'{base}.{digest}{ext}'
+
+        for filename in (name, result[name]):
+            with open(os.path.join(static_path, filename), 'wb') as f:
+                f.write(data)
+        path = os.path.join(static_path, result[name])
+        with open(f'{path}.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli:
+            with open(f'{path}.br', 'wb') as f:
+                f.write(brotli.compress(data))
+
+    with open(os.path.join(static_path, 'bundle.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+    manifest.cache_clear()
+    return result
 
-class JSBundleView(generic.View):
-    def get(self, *args, **kwargs):
-        response = http.HttpResponse(js())
-        response['Content-Type'] = 'text/javascript'
+
+class BundleView(generic.View):
+    '''
+    Serve a bundle with an ETag of its sources.
+
+    Conditional requests are answered without building the bundle, the
+    last bundles built are kept in memory by ETag.
+    '''
+    kind = None
+    content_type = None
+    bodies = LRUCache(32)
+
+    def get_sources(self):
+        '''Return the classes of a page bundle or None, and the files.'''
+        classes = None
+        if 'c' in self.request.GET:
+            classes = page_query(self.request, self.kind)
+        if classes is not None:
+            files = set()
+            for cls in classes:
+                files.update(class_files(cls))
+            return classes, sorted(files)
+        return None, bundle_files(*get_component_modules())
+
+    def get_etag(self, classes):
+        if classes is None:
+            key = fingerprint(*get_component_modules())
+        else:
+            key = ' '.join(class_fingerprint(cls) for cls in classes)
+        return hashlib.sha256(f'{self.kind} {key}'.encode('utf8')).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        classes, files = self.get_sources()
+        etag = quote_etag(self.get_etag(classes))
+        last_modified = int(max(
+            (os.stat(path).st_mtime for path in files), default=0))
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            body = self.bodies.get(etag)
+            if body is None:
+                body = self.build(classes)
+                self.bodies.set(etag, body)
+            response = http.HttpResponse(body)
+            response['Content-Type'] = self.content_type
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
         return response
 
     @classmethod
     def as_url(cls):
-        return path('bundle.js', cls.as_view(), name='bundle_js')
+        return path(
+            f'bundle.{cls.kind}', cls.as_view(), name=f'bundle_{cls.kind}')
+
+
+class CSSBundleView(BundleView):
+    kind = 'css'
+    content_type = 'text/css'
+
+    def build(self, classes):
+        return css() if classes is None else css_components(*classes)
+
+
+class JSBundleView(BundleView):
+    kind = 'js'
+    content_type = 'text/javascript'
+
+    def build(self, classes):
+        return js() if classes is None else js_components(*classes)
 
 
 urlpatterns = [
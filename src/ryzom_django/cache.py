@@ -0,0 +1,167 @@
+'''
+Cache the rendered HTML of component subtrees.
+
+.. code-block:: python
+
+    class Footer(Div):
+        cache_models = [Page]  # invalidated when a Page is saved
+
+        @classmethod
+        def cache_key(cls):
+            return get_language()
+
+    Body(Main(...), CachedFragment(Footer))
+
+Fragments are stored in the Django cache named by the RYZOM_FRAGMENT_CACHE
+setting, or in a process local LRU of RYZOM_FRAGMENT_CACHE_SIZE entries by
+default, which other processes don't see invalidations of.
+'''
+import functools
+import hashlib
+import inspect
+import sys
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+
+from ryzom import components
+from ryzom.cache import LRUCache, importable
+
+
+@functools.lru_cache()
+def get_cache():
+    '''Return the cache configured for fragments.'''
+    alias = getattr(settings, 'RYZOM_FRAGMENT_CACHE', None)
+    if alias:
+        return caches[alias]
+    return LRUCache(getattr(settings, 'RYZOM_FRAGMENT_CACHE_SIZE', 1024))
+
+
+def model_label(model):
+    return f'{model._meta.app_label}.{model.__name__}'
+
+
+def generation(model):
+    '''
+    Return the generation of a model, incremented on each invalidation.
+
+    If the cache lost it, start over from the current time rather than 0
+    which could match fragments rendered before.
+    '''
+    cache = get_cache()
+    key = f'ryzom.fragment.generation.{model_label(model)}'
+    value = cache.get(key)
+    if value is None:
+        value = time.time_ns()
+        if not cache.add(key, value, timeout=None):
+            value = cache.get(key, value)
+    return value
+
+
+def invalidate_fragments(model):
+    '''Invalidate fragments that declared they depend on model.'''
+    cache = get_cache()
+    key = f'ryzom.fragment.generation.{model_label(model)}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def find_class(name):
+    '''Return the class of a (module, qualname) name, None if not found.'''
+    module, qualname = name
+    value = sys.modules.get(module, None)
+    for part in qualname.split('.'):
+        value = getattr(value, part, None)
+    return value
+
+
+class CachedFragment:
+    '''
+    Render a component once, serve the cached HTML until invalidated.
+
+    Takes a component instance, or a component class and its arguments so
+    that it is only instanciated on cache misses. The key defaults to
+    the component cache_key(), which is called on the class when it is a
+    classmethod or staticmethod, otherwise the class is instanciated to get
+    it. Or pass key, the empty key caches a single version.
+
+    The cache version is the generation of models, which defaults to the
+    cache_models attribute of the component class, see
+    invalidate_fragments(). Context that inner components would bubble up
+    is not computed for cached fragments.
+
+    The component classes of the fragment are cached by name along with
+    its HTML, so that page bundles still include them on cache hits.
+    '''
+    tag = 'cached-fragment'
+
+    def __init__(self, component, *args, key=None, models=None,
+                 timeout=None, **kwargs):
+        self.component = component
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.cls = component if isinstance(component, type) else type(component)
+        if models is None:
+            models = getattr(self.cls, 'cache_models', ())
+        self.models = models
+        self.timeout = timeout
+        self.parent = None
+        self.position = 0
+
+    def get_component(self):
+        if isinstance(self.component, type):
+            self.component = self.component(*self.args, **self.kwargs)
+        self.component.parent = self.parent
+        self.component.position = self.position
+        return self.component
+
+    def get_key(self):
+        key = self.key
+        if key is None:
+            method = inspect.getattr_static(self.cls, 'cache_key', None)
+            if (
+                isinstance(self.component, type)
+                and isinstance(method, (classmethod, staticmethod))
+            ):
+                key = self.cls.cache_key()
+            else:
+                key = self.get_component().cache_key()
+        if key is None:
+            return None
+        digest = hashlib.md5(repr(key).encode('utf8')).hexdigest()
+        cls = f'{self.cls.__module__}.{self.cls.__qualname__}'
+        return f'ryzom.fragment.{cls}.{digest}'
+
+    def get_version(self):
+        return sum(generation(model) for model in self.models) or None
+
+    def to_html(self, *content, **context):
+        key = self.get_key()
+        if key is None:
+            return self.get_component().to_html(**context)
+
+        cache = get_cache()
+        version = self.get_version()
+        cached = cache.get(key, version=version)
+        if cached is None:
+            with components.recording() as classes:
+                component = self.get_component()
+                html = component.to_html(**context)
+            classes |= components.component_classes(component)
+            # by name, so that Django cache backends can pickle them
+            cached = (html, [
+                (cls.__module__, cls.__qualname__)
+                for cls in classes if importable(cls)
+            ])
+            cache.set(key, cached, timeout=self.timeout, version=version)
+        html, names = cached
+        components.record(*filter(None, map(find_class, names)))
+        return mark_safe(html)
+
+    def to_obj(self, context=None):
+        return self.get_component().to_obj(context)
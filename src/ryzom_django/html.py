@@ -6,8 +6,11 @@ from django.middleware.csrf import get_token
 from django.utils.html import escape
 from django.utils.safestring import SafeString, mark_safe
 
+from ryzom import components
 from ryzom.html import *
+from . import bundle
 from .bundle import CSSBundle, JSBundle
+from .cache import CachedFragment  # noqa: F401, for star importers
 
 
 def component_html(path, *args, **kwargs):
@@ -37,6 +40,14 @@ def component_to_html(self, *args, **kwargs):
 Component.to_html = component_to_html
 
 
+def text_node_to_html(self, *args, **kwargs):
+    if isinstance(self.content, SafeString):
+        return self.content
+    return escape(f'{self.content}')
+
+components.TextNode.to_html = text_node_to_html
+
+
 class ErrorList(Ul):
     def __init__(self, *content, **attrs):
         super().__init__(
@@ -53,6 +64,25 @@ class Html(Html):
     scripts = Html.scripts + [JSBundle()]
     stylesheets = Html.stylesheets + [CSSBundle()]
 
+    def iter_html(self, *content, **context):
+        '''
+        With RYZOM_BUNDLE_PAGES, render the body before the head, so that
+        bundles only load the code of components the page instanciated.
+        '''
+        content = content or self.content
+        if not bundle.pages() or self.body not in content:
+            yield from super().iter_html(*content, **context)
+            return
+
+        with components.recording() as classes:
+            body = ''.join(components.html_chunks(self.body, **context))
+        classes |= components.component_classes(self)
+        yield from super().iter_html(
+            *[mark_safe(f'\n{body}') if c is self.body else c for c in content],
+            bundle_classes=classes,
+            **context,
+        )
+
 
 class CSRFInput(Input):
     def __init__(self, request):
@@ -1,31 +1,27 @@
-import os
-
 from django.core.management.base import BaseCommand, CommandError
 
 from ryzom_django import bundle
 
 
 class Command(BaseCommand):
-    help = 'Write JS & CSS bundles to ryzom_django/static/bundle.*'
+    help = 'Write hashed JS & CSS bundles to ryzom_django/static/bundle.*'
 
-    def handle(self, *args, **options):
-        static_path = os.path.abspath(
-            os.path.join(
-                os.path.dirname(__file__),
-                '..',
-                '..',
-                'static',
-            )
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jobs', '-j', type=int, default=None,
+            help='Compile components in that many processes',
         )
 
-        if not os.path.exists(static_path):
-            os.makedirs(static_path)
-
-        with open(f'{static_path}/bundle.js', 'w+') as f:
-            f.write(bundle.js())
+    def handle(self, *args, **options):
+        report = []
+        result = bundle.write(report=report, jobs=options['jobs'])
 
-        with open(f'{static_path}/bundle.css', 'w+') as f:
-            f.write(bundle.css())
+        if options['verbosity'] > 1:
+            for name, seconds in report:
+                self.stdout.write(f'Rebuilt {name} in {seconds:.3f}s')
+            self.stdout.write(f'Rebuilt {len(report)} pieces')
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully wrote {static_path}/bundle.*'))
+        static_path = bundle.STATIC_PATH
+        names = ', '.join(result.values())
+        self.stdout.write(self.style.SUCCESS(f'Successfully wrote {names} in {static_path}'))
         self.stdout.write('Do not forget to collectstatic!')
@@ -0,0 +1,94 @@
+'''
+Panel for django-debug-toolbar with the render profile of the request.
+
+.. code-block:: python
+
+    DEBUG_TOOLBAR_PANELS = [
+        ...
+        'ryzom_django.panels.RyzomPanel',
+    ]
+
+Templates show up as their own frames when the Ryzom template backend runs
+in debug mode.
+'''
+from debug_toolbar.panels import Panel
+
+from ryzom import html
+from ryzom.profiler import Profiler, profile
+
+
+class RyzomPanel(Panel):
+    title = 'Ryzom'
+
+    def process_request(self, request):
+        self.profiler = Profiler()
+        with profile(self.profiler):
+            response = super().process_request(request)
+        if getattr(response, 'streaming', False) and not getattr(
+                response, 'is_async', False):
+            response.streaming_content = self.stream(
+                request, response, response.streaming_content)
+        return response
+
+    def stream(self, request, response, chunks):
+        '''
+        Profile the rendering of a streaming response as it is consumed,
+        which is after the toolbar generated its stats: generate them again
+        at the end, for when the panel is opened.
+        '''
+        chunks = iter(chunks)
+        while True:
+            with profile(self.profiler):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+            yield chunk
+        self.generate_stats(request, response)
+
+    def generate_stats(self, request, response):
+        profiler = getattr(self, 'profiler', None)
+        if profiler is None:
+            return
+        rows = [
+            dict(name=name, **stats)
+            for name, stats in profiler.as_dict().items()
+        ]
+        self.record_stats(dict(
+            rows=rows,
+            total=sum(row['self'] for row in rows),
+            collapsed=profiler.collapsed(),
+        ))
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats:
+            return ''
+        return f'{stats["total"] * 1000:.1f} ms'
+
+    @property
+    def content(self):
+        stats = self.get_stats()
+        rows = [
+            html.Tr(
+                html.Td(row['name']),
+                html.Td(str(row['count'])),
+                html.Td(f'{row["self"] * 1000:.2f}'),
+                html.Td(f'{row["cumulative"] * 1000:.2f}'),
+            )
+            for row in stats.get('rows', [])
+        ]
+        return html.Div(
+            html.Table(
+                html.Thead(html.Tr(
+                    html.Th('Component'),
+                    html.Th('Instances'),
+                    html.Th('Self (ms)'),
+                    html.Th('Cumulative (ms)'),
+                )),
+                html.Tbody(*rows),
+            ),
+            html.H4('Collapsed stacks'),
+            html.Pre(stats.get('collapsed', '')),
+        ).render()
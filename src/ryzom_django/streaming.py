@@ -0,0 +1,26 @@
+from django import http
+from django.template import loader
+
+
+class StreamingTemplateResponseMixin:
+    '''
+    Stream the rendering of a Ryzom template instead of building it in memory.
+
+    Mix it before a Django TemplateResponseMixin view, ie. a generic
+    TemplateView, FormView, ListView ... The page will start flushing to the
+    client as soon as its first chunk is rendered. Templates from other
+    backends render as usual.
+    '''
+    def render_to_response(self, context, **response_kwargs):
+        template = loader.select_template(
+            self.get_template_names(),
+            using=self.template_engine,
+        )
+        if not hasattr(template, 'render_stream'):
+            return super().render_to_response(context, **response_kwargs)
+
+        response_kwargs.setdefault('content_type', self.content_type)
+        return http.StreamingHttpResponse(
+            template.render_stream(context, self.request),
+            **response_kwargs,
+        )
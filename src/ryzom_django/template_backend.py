@@ -1,3 +1,4 @@
+import contextlib
 import functools
 
 from django.conf import settings
@@ -12,7 +13,10 @@ from django.utils.encoding import smart_str
 from django.utils.functional import SimpleLazyObject, cached_property
 from django.utils.module_loading import import_string
 
-from ryzom import html
+from ryzom import html, profiler
+
+
+STREAM_CHUNK_SIZE = 8192
 
 
 class Ryzom(BaseEngine):
@@ -92,13 +96,7 @@ class Template:
             template_name=self.name  # TODO: No searching of app_dirs yet.
         )
 
-    def render(self, context=None, request=None):  # noqa: C901
-        from django.utils.safestring import mark_safe
-        try:
-            from jinja2.utils import Markup
-        except ImportError:
-            Markup = None
-
+    def get_context(self, context=None, request=None):  # noqa: C901
         if context is None:
             context = {}
         if request is not None:
@@ -133,8 +131,53 @@ class Template:
             signals.template_rendered.send(sender=self,
                                            template=self,
                                            context=context)
+        return context
+
+    def profile(self, key=None):
+        '''
+        Time the template as a frame of the current profiler in debug mode,
+        for the Ryzom panel of django-debug-toolbar. Frames of the same key
+        count as one rendering.
+        '''
+        if self.backend.debug:
+            return profiler.frame(self.name, key)
+        return contextlib.nullcontext()
+
+    def render(self, context=None, request=None):
+        from django.utils.safestring import mark_safe
+        try:
+            from jinja2.utils import Markup
+        except ImportError:
+            Markup = None
 
-        html = self.template().render(**context)
+        context = self.get_context(context, request)
+        with self.profile():
+            html = self.template().render(**context)
         if Markup:
             html = Markup(html)
         return mark_safe(html)
+
+    def render_stream(self, context=None, request=None):
+        '''
+        Yield the rendered HTML in chunks of about STREAM_CHUNK_SIZE
+        characters, to use with a StreamingHttpResponse.
+        '''
+        context = self.get_context(context, request)
+        buffer, size = [], 0
+        # rendering happens as chunks are consumed, time each step alone
+        key = object()
+        with self.profile(key):
+            chunks = self.template().iter_render(**context)
+        while True:
+            with self.profile(key):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer)
@@ -9,17 +9,43 @@ import json
 from datetime import timedelta
 
 from asgiref.sync import async_to_sync
-from channels.auth import get_user, login
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.auth import get_user, login, logout
+from channels.db import database_sync_to_async
+from channels.generic.websocket import (AsyncJsonWebsocketConsumer,
+                                        JsonWebsocketConsumer)
 from django.conf import settings
 from django.contrib.auth import authenticate
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from django.utils import timezone
 
 from ryzom_django_channels.methods import Methods
 from ryzom_django_channels.models import Client, Publication, Subscription
 
 
+def ddp_params(params):
+    '''
+    Return the params of a DDP frame for the client from the params of a
+    handle.ddp message of the channel layer.
+    '''
+    if params['type'] == 'batch':
+        return {
+            'type': 'batch',
+            'params': [ddp_params(message) for message in params['messages']]
+        }
+    elif params['type'] == 'removed':
+        return {
+            'type': 'remove',
+            'params': {
+                'id': params['id'],
+                'parent': params['parent']
+            }
+        }
+    return {
+        'type': 'insert' if params['type'] == 'inserted' else 'change',
+        'params': params['instance']
+    }
+
+
 class Consumer(JsonWebsocketConsumer):
     '''
     Consumer class, inherited from the channels' JsonWebsocketConsumer
@@ -33,6 +59,13 @@ class Consumer(JsonWebsocketConsumer):
     for module in settings.SERVER_METHODS:
         importlib.import_module(module)
 
+    '''
+    Client and user of the connection, cached from connect() until
+    disconnect() and updated on login and logout
+    '''
+    client = None
+    user = None
+
     def connect(self):
         '''
         Websocket connect handler.
@@ -45,16 +78,20 @@ class Consumer(JsonWebsocketConsumer):
         user = async_to_sync(get_user)(self.scope)
         token = self.scope['query_string'].decode()
         if token:
-            client = Client.objects.filter(token=token).last()
+            client = Client.objects.select_related('user').filter(
+                token=token).last()
             if client and client.user:
                 async_to_sync(login)(self.scope, client.user)
                 self.scope['session'].save()
+                user = client.user
 
         self.accept()
+        self.user = user
         if client and client.channel != self.channel_name:
             client.channel = self.channel_name
             client.user = user if isinstance(user, User) else None
             client.save()
+            self.client = client
             self.send(json.dumps({'type': 'Connected'}))
         else:
             self.send(json.dumps({'type': 'Reload'}))
@@ -67,9 +104,8 @@ class Consumer(JsonWebsocketConsumer):
         Zombies that may stay in our DB on server reboots are removed in
         the ryzom.apps Appconfig.ready() function
         '''
-        client = Client.objects.filter(channel=self.channel_name)
-        if client.count():
-            client.delete()
+        Client.objects.filter(channel=self.channel_name).delete()
+        self.client = None
 
         expiration = timezone.now() - timedelta(minutes=2)
         deadclients = Client.objects.filter(channel='', created__lt=expiration)
@@ -91,7 +127,7 @@ class Consumer(JsonWebsocketConsumer):
         - a 'params' key, which is used as a parameter, specific to
         each message type.
         '''
-        if not Client.objects.filter(channel=self.channel_name).count():
+        if self.client is None:
             self.send(json.dumps({'type': 'Reload'}))
             return
 
@@ -151,14 +187,13 @@ class Consumer(JsonWebsocketConsumer):
         if user:
             async_to_sync(login)(self.scope, user)
             self.scope['session'].save()
-            client = Client.objects.get(channel=self.channel_name)
-            client.user = user
-            client.save()
+            self.user = self.client.user = user
+            self.client.save(update_fields=['user'])
             self.send(json.dumps({
                 'id': data['id'],
                 'type': 'Success',
                 'params': {
-                    'token': f'{client.token}'
+                    'token': f'{self.client.token}'
                 }
             }))
         else:
@@ -172,7 +207,16 @@ class Consumer(JsonWebsocketConsumer):
             }))
 
     def recv_logout(self, data):
-        pass
+        async_to_sync(logout)(self.scope)
+        self.scope['session'].save()
+        self.user = AnonymousUser()
+        self.client.user = None
+        self.client.save(update_fields=['user'])
+        self.send(json.dumps({
+            'id': data['id'],
+            'type': 'Success',
+            'params': {}
+        }))
 
     def recv_geturl(self, data):
         '''
@@ -184,31 +228,39 @@ class Consumer(JsonWebsocketConsumer):
         view's callback (oncreate, ondestroy) are called here
         '''
         to_url = data['params'].get('url', '/')
-        to_query = data['params'].get('query', '')
+        matched, ok = self.route(self.client, to_url)
+        if not matched:
+            return
+        if ok:
+            self.send(json.dumps({
+                'id': data['id'],
+                'type': 'Success',
+                'params': []
+            }))
+        else:
+            self.send(json.dumps({
+                'id': data['id'],
+                'type': 'Error',
+                'params': ''
+            }))
+
+    def route(self, client, to_url):
+        '''
+        Attach the view of the first ddp_urlpattern matching to_url.
+        Return whether a pattern matched and the result of the view's
+        onurl(). Blocking, the async consumer calls it in a thread.
+        '''
         for url in Consumer.ddp_urlpatterns:
             if url.pattern.match(to_url):
                 cview = getattr(self, 'view', None)
                 if not cview or not isinstance(cview, url.callback):
                     if cview:
                         cview.ondestroy()
-                    client = Client.objects.filter(channel=self.channel_name).last()
                     req = Request(client, url.callback)
                     cview = self.view = url.callback(req)
                     cview.oncreate(to_url)
-                if (cview.onurl(to_url)):
-                    self.send(json.dumps({
-                        'id': data['id'],
-                        'type': 'Success',
-                        'params': []
-                    }))
-                else:
-                    data = {
-                        'id': data['id'],
-                        'type': 'Error',
-                        'params': ''
-                    }
-                    self.send(json.dumps(data))
-                break
+                return True, cview.onurl(to_url)
+        return False, None
 
     def recv_method(self, data):
         '''
@@ -231,8 +283,7 @@ class Consumer(JsonWebsocketConsumer):
                 }
             })
         else:
-            user = async_to_sync(get_user)(self.scope)
-            ret = method(user, params['params'])
+            ret = method(self.user, params['params'])
             if ret:
                 to_send.update({
                     'type': 'Success',
@@ -280,7 +331,8 @@ class Consumer(JsonWebsocketConsumer):
         '''
         DDP dispacher.
         handler for 'handle.ddp' messages sent over the channel layer.
-        dispaches the message to the above two methods
+        dispaches the message to the above two methods, a batch of
+        messages is sent to the client in a single frame
         '''
         if data['params']['type'] == 'inserted':
             self.insert_component(data['params'])
@@ -288,6 +340,11 @@ class Consumer(JsonWebsocketConsumer):
             self.insert_component(data['params'], True)
         elif data['params']['type'] == 'removed':
             self.remove_component(data['params'])
+        elif data['params']['type'] == 'batch':
+            self.send(json.dumps({
+                'type': 'DDP',
+                'params': ddp_params(data['params'])
+            }))
 
     def recv_subscribe(self, data):
         '''
@@ -301,7 +358,7 @@ class Consumer(JsonWebsocketConsumer):
         '''
         params = data['params']
         to_send = {'id': data['id']}
-        client = Client.objects.get(channel=self.channel_name)
+        client = self.client
         print(f'GOT SUBSCRIBE FOR CLIENT {client}')
         for key in ['name', 'sub_id']:
             if key not in params:
@@ -364,3 +421,225 @@ class Consumer(JsonWebsocketConsumer):
                 'name': params['name']
             }
         }))
+
+
+class AsyncConsumer(AsyncJsonWebsocketConsumer):
+    '''
+    Async version of Consumer, with the same protocol as ryzom.js.
+
+    The Client and user of the connection are kept in memory, and each
+    message does its blocking work in a single database_sync_to_async call,
+    so idle sockets don't hold a thread.
+    '''
+    client = None
+    user = None
+    route = Consumer.route
+
+    async def connect(self):
+        '''
+        Websocket connect handler, see Consumer.connect().
+        '''
+        self.subscriptions = {}
+        self.user = await get_user(self.scope)
+        token = self.scope['query_string'].decode()
+        client = None
+        if token:
+            client = await database_sync_to_async(
+                Client.objects.select_related('user').filter(
+                    token=token).last)()
+            if client and client.user:
+                await login(self.scope, client.user)
+                await database_sync_to_async(self.scope['session'].save)()
+                self.user = client.user
+
+        await self.accept()
+        if client and client.channel != self.channel_name:
+            client.channel = self.channel_name
+            client.user = self.user if isinstance(self.user, User) else None
+            await database_sync_to_async(client.save)()
+            self.client = client
+            await self.send_json({'type': 'Connected'})
+        else:
+            await self.send_json({'type': 'Reload'})
+
+    async def disconnect(self, close_code):
+        '''
+        Websocket disconnect handler, see Consumer.disconnect().
+        '''
+        await database_sync_to_async(self.delete_clients)()
+        self.client = None
+        self.subscriptions = {}
+
+    def delete_clients(self):
+        Client.objects.filter(channel=self.channel_name).delete()
+        expiration = timezone.now() - timedelta(minutes=2)
+        Client.objects.filter(channel='', created__lt=expiration).delete()
+
+    async def error(self, id, name, message):
+        await self.send_json({
+            'id': id,
+            'type': 'Error',
+            'params': {
+                'name': name,
+                'message': message,
+            }
+        })
+
+    async def receive_json(self, data, **kwargs):
+        '''
+        Websocket message handler, see Consumer.receive().
+        '''
+        if self.client is None:
+            await self.send_json({'type': 'Reload'})
+            return
+
+        if not data.get('id', None):
+            return
+        if 'type' not in data:
+            await self.error(data['id'], 'Bad message',
+                             'message type not found')
+            return
+
+        msg_type = data['type']
+        if msg_type not in [
+                'subscribe', 'unsubscribe',
+                'method', 'geturl',
+                'login', 'logout', 'ping']:
+            await self.error(data['id'], 'Bad message type',
+                             f'{msg_type} not recognized')
+            return
+
+        func = getattr(self, f'recv_{msg_type}', None)
+        if func:
+            if data.get('params', None) is None:
+                await self.error(data['id'], 'Bad format',
+                                 '"params" key not found')
+            else:
+                await func(data)
+
+    async def recv_ping(self, data):
+        await self.send_json({
+            'id': data['id'],
+            'type': 'pong'
+        })
+
+    async def recv_login(self, data):
+        user = await database_sync_to_async(authenticate)(**data['params'])
+        if not user:
+            await self.error(data['id'], 'Credentials mismatch',
+                             'Wrong username/password combination')
+            return
+
+        await login(self.scope, user)
+        self.user = self.client.user = user
+        await database_sync_to_async(self.save_login)()
+        await self.send_json({
+            'id': data['id'],
+            'type': 'Success',
+            'params': {
+                'token': f'{self.client.token}'
+            }
+        })
+
+    def save_login(self):
+        self.scope['session'].save()
+        self.client.save(update_fields=['user'])
+
+    async def recv_logout(self, data):
+        await logout(self.scope)
+        self.user = AnonymousUser()
+        self.client.user = None
+        await database_sync_to_async(self.save_login)()
+        await self.send_json({
+            'id': data['id'],
+            'type': 'Success',
+            'params': {}
+        })
+
+    async def recv_geturl(self, data):
+        '''
+        geturl message handler, see Consumer.recv_geturl().
+        '''
+        to_url = data['params'].get('url', '/')
+        matched, ok = await database_sync_to_async(self.route)(
+            self.client, to_url)
+        if not matched:
+            return
+        await self.send_json({
+            'id': data['id'],
+            'type': 'Success' if ok else 'Error',
+            'params': [] if ok else '',
+        })
+
+    async def recv_method(self, data):
+        '''
+        method message handler, see Consumer.recv_method().
+        Methods are blocking and run in a thread.
+        '''
+        params = data['params']
+        method = Methods.get(params['name'])
+        if method is None:
+            await self.error(data['id'], 'Not found',
+                             f'Method {params["name"]} not found')
+            return
+
+        ret = await database_sync_to_async(method)(self.user, params['params'])
+        await self.send_json({
+            'id': data['id'],
+            'type': 'Success' if ret else 'Error',
+            'params': ret,
+        })
+
+    async def handle_ddp(self, data):
+        '''
+        DDP dispacher, see Consumer.handle_ddp().
+        '''
+        await self.send_json({
+            'type': 'DDP',
+            'params': ddp_params(data['params'])
+        })
+
+    async def recv_subscribe(self, data):
+        '''
+        subscribe message handler, see Consumer.recv_subscribe().
+        '''
+        params = data['params']
+        for key in ['name', 'sub_id']:
+            if key not in params:
+                await self.error(data['id'], 'Bad format',
+                                 f'Subscription {key} not found')
+                return
+
+        sub = await database_sync_to_async(self.subscribe)(params)
+        self.subscriptions[params['sub_id']] = sub
+        await self.send_json({
+            'id': data['id'],
+            'type': 'Success',
+            'params': {
+                'name': params['name'],
+                'sub_id': f'{sub.id}',
+                'length': len(sub.queryset)
+            }
+        })
+
+    def subscribe(self, params):
+        pub = Publication.objects.get(name=params['name'])
+        sub, created = Subscription.objects.select_related(
+            'publication', 'client__user',
+        ).get_or_create(
+            publication=pub,
+            subscriber_id=params['parent_id'],
+            client=self.client,
+        )
+        sub.get_queryset(params['opts'] or None)
+        return sub
+
+    async def recv_unsubscribe(self, data):
+        await self.send_json({
+            'id': data['id'],
+            'type': 'unsubscribed',
+            'message': 'Got unsub',
+            'params': {
+                'name': data['params']['name']
+            }
+        })
@@ -1,11 +1,240 @@
 '''
 Functions to communicate DDP messages to the channel layer.
+
+Messages are queued in an Outbox until the current transaction commits,
+repeated messages about the same component are coalesced, and each client
+receives a single batch message per transaction, or per savepoint when
+nested atomic() blocks queue messages too.
 '''
+import contextlib
+import threading
+
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+_local = threading.local()
+
+
+class Outbox:
+    '''
+    DDP messages of a transaction, by channel then by component.
+
+    Coalescing rules for a component, by previous then new message:
+
+    - inserted then changed: inserted, with the latest instance
+    - inserted then removed: nothing, the client never saw it
+    - changed then removed: removed
+    - removed then inserted: changed
+
+    Positions are those of the latest queryset of each subscription.
+    '''
+    def __init__(self):
+        self.messages = dict()
+        self.subs = dict()
+
+    def add(self, type, sub, model, tmpl, id):
+        channel = sub.client.channel
+        messages = self.messages.setdefault(channel, dict())
+        self.subs[channel, sub.subscriber_id] = sub
+        key = (sub.subscriber_id, id)
+        previous = messages.get(key, (None,))[0]
+
+        if previous == 'inserted' and type == 'changed':
+            type = 'inserted'
+        elif previous == 'inserted' and type == 'removed':
+            del messages[key]
+            return
+        elif previous == 'removed' and type == 'inserted':
+            type = 'changed'
+
+        messages.pop(key, None)
+        messages[key] = (type, sub.subscriber_id, model, tmpl, id)
+
+    def flush(self):
+        '''
+        Send one batch message per channel.
+        Removals go first, then inserts and changes by position, so that
+        the client can apply them in order.
+        Instances are fetched with one query per model, and each template
+        is rendered once per instance for all subscribers.
+        '''
+        batches = dict()
+        for channel, messages in self.messages.items():
+            messages = [
+                (type, self.subs[channel, subscriber_id], model, tmpl, id)
+                for type, subscriber_id, model, tmpl, id in messages.values()
+            ]
+            batches[channel] = [
+                m for m in messages if m[0] == 'removed'
+            ] + sorted(
+                (m for m in messages if m[0] != 'removed'),
+                key=lambda m: position(m[1], m[4]),
+            )
+        self.messages = dict()
+        self.subs = dict()
+
+        instances = fetch(
+            m for messages in batches.values() for m in messages)
+        payloads = dict()
+        channel_layer = get_channel_layer()
+        for channel, messages in batches.items():
+            batch = [
+                params for params in (
+                    render(message, instances, payloads)
+                    for message in messages
+                )
+                if params is not None
+            ]
+            if batch:
+                async_to_sync(channel_layer.send)(channel, {
+                    'type': 'handle.ddp',
+                    'params': {
+                        'type': 'batch',
+                        'messages': batch,
+                    }
+                })
+
+
+def position(sub, id):
+    return sub.queryset.index(id) if id in sub.queryset else len(sub.queryset)
 
 
-def send_insert(sub, model, tmpl, id):
+def fetch(messages):
+    '''
+    Return the instances to render by model and id, with one in_bulk()
+    per model and related options of the publications.
+    '''
+    ids = dict()
+    related = dict()
+    for type, sub, model, tmpl, id in messages:
+        if type != 'removed':
+            # related imports the publish function, once per publication
+            name = sub.publication.name
+            if name not in related:
+                related[name] = sub.publication.related
+            key = (model, related[name])
+            ids.setdefault(key, set()).add(id)
+
+    instances = dict()
+    for (model, (select_related, prefetch_related)), pks in ids.items():
+        queryset = model.objects.all()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        for pk, instance in queryset.in_bulk(pks).items():
+            instances[model, pk] = instance
+    return instances
+
+
+def render(message, instances, payloads):
+    '''
+    Return the params of a handle.ddp message for an outbox message,
+    None if the instance doesn't exist anymore.
+    The to_obj() payload of a template and instance is computed once in
+    payloads, only parent and position are specific to the subscriber.
+    '''
+    type, sub, model, tmpl, id = message
+    if type == 'removed':
+        tmp = model()
+        tmp.id = id
+        return {
+            'type': 'removed',
+            'id': tmpl(tmp).id,
+            'parent': sub.subscriber_id
+        }
+
+    instance = instances.get((model, id))
+    if instance is None:
+        return
+    if (tmpl, model, id) not in payloads:
+        payloads[tmpl, model, id] = tmpl(instance).to_obj()
+    return {
+        'type': type,
+        'instance': dict(
+            payloads[tmpl, model, id],
+            parent=sub.subscriber_id,
+            position=position(sub, id),
+        )
+    }
+
+
+def pending(connection, outbox):
+    '''Return True if the flush of outbox waits for a commit.'''
+    return any(entry[1] == outbox.flush for entry in connection.run_on_commit)
+
+
+def get_outbox(connection):
+    '''
+    Return the Outbox of the current savepoint of a connection, it is
+    flushed when the transaction commits.
+
+    Each savepoint has its own Outbox, so that rolling back a savepoint
+    discards its messages along with its pending flush, while those of the
+    enclosing blocks are still sent. Outboxes are coalesced separately, so
+    a transaction sends one batch per client and savepoint that has
+    messages.
+    '''
+    outboxes = getattr(_local, 'outboxes', None)
+    if outboxes is None:
+        outboxes = _local.outboxes = dict()
+
+    # like on_commit(), atomic(savepoint=False) blocks have a None sid
+    sids = tuple(sid for sid in connection.savepoint_ids if sid is not None)
+    key = (connection.alias, sids)
+    outbox = outboxes.get(key)
+    if outbox is None or not pending(connection, outbox):
+        # forget outboxes that were flushed or rolled back
+        for other in [
+            other for other, value in outboxes.items()
+            if other[0] == connection.alias and not pending(connection, value)
+        ]:
+            del outboxes[other]
+        outbox = outboxes[key] = Outbox()
+        transaction.on_commit(outbox.flush, using=connection.alias)
+    return outbox
+
+
+def send(type, sub, model, tmpl, id, using=None):
+    '''
+    Queue a message in the Outbox of the current transaction, or of the
+    current batch() in autocommit mode, or send it right away.
+    '''
+    if sub.client is None or sub.client.channel == '':
+        return
+
+    connection = transaction.get_connection(using or DEFAULT_DB_ALIAS)
+    if connection.in_atomic_block:
+        get_outbox(connection).add(type, sub, model, tmpl, id)
+    elif getattr(_local, 'batch', None) is not None:
+        _local.batch.add(type, sub, model, tmpl, id)
+    else:
+        outbox = Outbox()
+        outbox.add(type, sub, model, tmpl, id)
+        outbox.flush()
+
+
+@contextlib.contextmanager
+def batch():
+    '''
+    Send the messages of the block in autocommit mode together, on exit.
+    Signal handlers use it so that a save sends one message per client.
+    '''
+    if getattr(_local, 'batch', None) is not None:
+        yield
+        return
+
+    outbox = _local.batch = Outbox()
+    try:
+        yield
+    finally:
+        _local.batch = None
+    outbox.flush()
+
+
+def send_insert(sub, model, tmpl, id, using=None):
     '''
     Send insert message.
     Function used to send a DDP message to a specific client
@@ -21,25 +250,12 @@ def send_insert(sub, model, tmpl, id):
     :param Component tmpl: The component subclass that templates \
             the model instance
     :param int id: The id of the model to insert
+    :param str using: The database alias of the transaction
     '''
-    if sub.client is None or sub.client.channel == '':
-        return
-
-    tmpl_instance = tmpl(model.objects.get(id=id))
-    tmpl_instance.parent = sub.subscriber_id
-    tmpl_instance.position = sub.queryset.index(id)
-    data = {
-        'type': 'handle.ddp',
-        'params': {
-            'type': 'inserted',
-            'instance': tmpl_instance.to_obj()
-        }
-    }
-    channel = get_channel_layer()
-    async_to_sync(channel.send)(sub.client.channel, data)
+    send('inserted', sub, model, tmpl, id, using)
 
 
-def send_change(sub, model, tmpl, id):
+def send_change(sub, model, tmpl, id, using=None):
     '''
     Send change message.
     Function used to send a DDP message to a specific client
@@ -55,25 +271,12 @@ def send_change(sub, model, tmpl, id):
     :param Component tmpl: The component subclass that templates \
             the model instance
     :param int id: The id of the model to change
+    :param str using: The database alias of the transaction
     '''
-    if sub.client is None or sub.client.channel == '':
-        return
+    send('changed', sub, model, tmpl, id, using)
 
-    tmpl_instance = tmpl(model.objects.get(id=id))
-    tmpl_instance.parent = sub.subscriber_id
-    tmpl_instance.position = sub.queryset.index(id)
-    data = {
-        'type': 'handle.ddp',
-        'params': {
-            'type': 'changed',
-            'instance': tmpl_instance.to_obj()
-        }
-    }
-    channel = get_channel_layer()
-    async_to_sync(channel.send)(sub.client.channel, data)
 
-
-def send_remove(sub, model, tmpl, id):
+def send_remove(sub, model, tmpl, id, using=None):
     '''
     Send remove message.
     Function used to send a DDP message to a specific client
@@ -90,20 +293,6 @@ def send_remove(sub, model, tmpl, id):
     :param Component tmpl: The component subclass that templates \
             the model instance
     :param int id: The id of the model to remove
+    :param str using: The database alias of the transaction
     '''
-    if sub.client is None or sub.client.channel == '':
-        return
-
-    tmp = model()
-    tmp.id = id
-    tmpl_instance = tmpl(tmp)
-    data = {
-        'type': 'handle.ddp',
-        'params': {
-            'type': 'removed',
-            'id': tmpl_instance.id,
-            'parent': sub.subscriber_id
-        }
-    }
-    channel = get_channel_layer()
-    async_to_sync(channel.send)(sub.client.channel, data)
+    send('removed', sub, model, tmpl, id, using)
@@ -3,6 +3,7 @@ This file defines the models needed for ryzom pub/sub system.
 They're not intended to be used by end-user.
 '''
 import importlib
+import json
 import secrets
 import uuid
 
@@ -68,6 +69,17 @@ class Publication(models.Model):
         )
         return getattr(model, self.name)
 
+    @property
+    def related(self):
+        '''
+        Return the select_related and prefetch_related of the publication.
+        '''
+        function = self.publish_function
+        return (
+            getattr(function, 'select_related', ()),
+            getattr(function, 'prefetch_related', ()),
+        )
+
 
 class Subscription(models.Model):
     '''
@@ -94,6 +106,30 @@ class Subscription(models.Model):
         subscriber_mod = importlib.import_module(self.subscriber_module)
         return getattr(subscriber_mod, self.subscriber_class)
 
+    @property
+    def query_key(self):
+        '''
+        Subscriptions with the same query_key have the same queryset.
+        '''
+        return (
+            self.publication_id,
+            self.subscriber_module,
+            self.subscriber_class,
+            json.dumps(self.options, sort_keys=True),
+            self.client.user_id if self.client else None,
+        )
+
+    def build_queryset(self, opts=None):
+        '''
+        Return the queryset of the publication for this subscription,
+        without updating it.
+        '''
+        queryset = self.publication.publish_function(self.client.user)
+
+        opts = opts or self.options
+        return self.subscriber.get_queryset(
+            self.client.user, queryset, opts)
+
     def get_queryset(self, opts=None):  # noqa: C901
         '''
         This method computes the publication query and create/update the
@@ -104,14 +140,9 @@ class Subscription(models.Model):
         More will come with special variables and function. Such as an $add
         to replace that ugly tupple i'm using for now.. to be discussed
         '''
+        queryset = self.build_queryset(opts)
 
-        queryset = self.publication.publish_function(self.client.user)
-
-        opts = opts or self.options
-        queryset = self.subscriber.get_queryset(
-            self.client.user, queryset, opts)
-
-        self.options = opts
+        self.options = opts or self.options
         self.queryset = list(queryset.values_list('id', flat=True))
         self.save()
 
@@ -1,3 +1,6 @@
+import functools
+
+
 class Publishable:
     '''
     The publishable class is meant to be inherited from
@@ -32,10 +35,31 @@ class Publishable:
             Publication.objects.create(name=name, **model_params)
 
 
-def publish(func):
-    @classmethod
+def publish(func=None, select_related=(), prefetch_related=()):
+    '''
+    Decorate a classmethod of a Publishable model as a publication.
+
+    select_related and prefetch_related apply to the instances fetched
+    to render the model template in DDP messages:
+
+    .. code-block:: python
+
+        @publish(select_related=['user'])
+        def messages(cls, user):
+            return cls.objects.all()
+    '''
+    if func is None:
+        return functools.partial(
+            publish,
+            select_related=select_related,
+            prefetch_related=prefetch_related,
+        )
+
     def wrapper(*args):
         return func(*args)
+    wrapper.select_related = tuple(select_related)
+    wrapper.prefetch_related = tuple(prefetch_related)
+    wrapper = classmethod(wrapper)
     wrapper.__publication__ = True
     wrapper.__name__ = func.__name__
     return wrapper
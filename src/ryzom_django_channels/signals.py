@@ -1,18 +1,71 @@
 '''
 Defines the django signals handlers.
 '''
-import importlib
+import collections
 
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from ryzom_django.cache import invalidate_fragments
 from ryzom_django_channels.components import model_templates
-from ryzom_django_channels.ddp import send_change, send_insert, send_remove
+from ryzom_django_channels.ddp import (batch, send_change, send_insert,
+                                      send_remove)
 from ryzom_django_channels.models import Publication, Subscription
 from ryzom_django_channels.pubsub import Publishable
 
 
+@receiver(post_save)
+@receiver(post_delete)
+def _invalidate_fragments(sender, **kwargs):
+    '''
+    Invalidate the cached fragments that depend on a Publishable model
+    whenever one of its instances is saved or deleted.
+    '''
+    if Publishable in sender.mro():
+        invalidate_fragments(sender)
+
+
+def _subscriptions(model):
+    '''
+    Return the subscriptions to a model, grouped by query_key.
+    '''
+    subscriptions = Subscription.objects.filter(
+        client__isnull=False,
+        publication__model_class=model.__name__,
+        publication__model_module=model.__module__,
+    ).select_related('client__user', 'publication')
+
+    groups = collections.defaultdict(list)
+    for sub in subscriptions:
+        groups[sub.query_key].append(sub)
+    return groups.values()
+
+
+def _matches(queryset, instance):
+    '''
+    Return False if the instance is certainly not in the queryset.
+    Sliced querysets can't be filtered, assume they match.
+    '''
+    if queryset.query.is_sliced:
+        return True
+    return queryset.filter(pk=instance.pk).exists()
+
+
+def _update(subs, new_qs):
+    '''
+    Store the new queryset of a group of subscriptions in one query.
+    Return the old querysets by subscription.
+    '''
+    old = {sub.pk: sub.queryset for sub in subs}
+    stale = [sub.pk for sub in subs if sub.queryset != new_qs]
+    if stale:
+        Subscription.objects.filter(pk__in=stale).update(queryset=new_qs)
+    for sub in subs:
+        sub.queryset = new_qs
+    return old
+
+
 @receiver(post_save)
 def _ddp_insert_change(sender, **kwargs):
     '''
@@ -22,55 +75,58 @@ def _ddp_insert_change(sender, **kwargs):
     associated with the sender model and send insert, remove or change
     message for each id that was added or removed from the old
     queryset to the new one.
+    Subscriptions with the same query are grouped, each query runs at
+    most once, and not at all when the instance neither was nor is in its
+    result.
     '''
     if Publishable not in sender.mro():
         return
 
     created = kwargs.pop('created')
     instance = kwargs.pop('instance')
-
-    subscriptions = Subscription.objects.filter(
-        publication__model_class=sender.__name__,
-        publication__model_module=sender.__module__)
-
-    for sub in subscriptions:
-        template = model_templates[sub.subscriber.model_template]
-        old_qs = sub.queryset
-
-        sub.get_queryset()
-        new_qs = sub.queryset
-
-        diff = {
-            'inserted': set(new_qs).difference(set(old_qs)),
-            'removed': set(old_qs).difference(set(new_qs))
-        }
-        # if sets are the same
-        if not diff['inserted'] and not diff['removed']:
-            # if created and sets are the same,
-            # entry has been filtered and can't be there
-            if not created:
-                # changed and may have moved
-                # just send new instance and pos
-                send_change(sub, sender, template, instance.id)
-
-        # if sets aren't the same, then considering that only one entry
-        # was added or has changed:
-        # - it could have been removed if newly filtered (changed)
-        # - it could have been added if no more filtered (changed)
-        # - it could have been added if created and not filtered
-        # - it cannot have just moved neither changed or the set
-        #   would have been the same
-        # - it could have been added while not created, replacing
-        #   another entry because of filters, so created or not,
-        #   we have to handle both added and removed entries
-        else:
-            # using loops for now but shouldn't be usefull as we
-            # are handling only one entry, the queryset shouldn't
-            # move by more that one in and/or one out
-            for id in diff['removed']:
-                send_remove(sub, sender, template, id)
-            for id in diff['inserted']:
-                send_insert(sub, sender, template, id)
+    using = kwargs.get('using')
+
+    with batch():
+        for subs in _subscriptions(sender):
+            queryset = subs[0].build_queryset()
+            if all(instance.id not in sub.queryset for sub in subs):
+                if not _matches(queryset, instance):
+                    continue
+
+            template = model_templates[subs[0].subscriber.model_template]
+            new_qs = list(queryset.values_list('id', flat=True))
+            old = _update(subs, new_qs)
+
+            for sub in subs:
+                old_qs = old[sub.pk]
+                diff = {
+                    'inserted': set(new_qs).difference(set(old_qs)),
+                    'removed': set(old_qs).difference(set(new_qs))
+                }
+                # if sets are the same
+                if not diff['inserted'] and not diff['removed']:
+                    # if created and sets are the same,
+                    # entry has been filtered and can't be there
+                    if not created and instance.id in new_qs:
+                        # changed and may have moved
+                        # just send new instance and pos
+                        send_change(sub, sender, template, instance.id, using)
+
+                # if sets aren't the same, then considering that only one entry
+                # was added or has changed:
+                # - it could have been removed if newly filtered (changed)
+                # - it could have been added if no more filtered (changed)
+                # - it could have been added if created and not filtered
+                # - it cannot have just moved neither changed or the set
+                #   would have been the same
+                # - it could have been added while not created, replacing
+                #   another entry because of filters, so created or not,
+                #   we have to handle both added and removed entries
+                else:
+                    for id in diff['removed']:
+                        send_remove(sub, sender, template, id, using)
+                    for id in diff['inserted']:
+                        send_insert(sub, sender, template, id, using)
 
 
 @receiver(post_delete)
@@ -87,28 +143,29 @@ def _ddp_delete(sender, **kwargs):
         return
 
     instance = kwargs.pop('instance')
-    subscriptions = Subscription.objects.filter(
-        publication__model_class=sender.__name__,
-        publication__model_module=sender.__module__)
-
-    for sub in subscriptions:
-        template = model_templates[sub.subscriber.model_template]
-
-        old_qs = sub.queryset
-
-        # if instance not in queryset, no need to remove it
-        # or update the queryset
-        # else:
-        if instance.id in old_qs:
-            sub.get_queryset()
-            new_qs = sub.queryset
-
-            diff = {
-                'inserted': set(new_qs).difference(set(old_qs)),
-                'removed': set(old_qs).difference(set(new_qs))
-            }
-
-            for id in diff['removed']:
-                send_remove(sub, sender, template, id)
-            for id in diff['inserted']:
-                send_insert(sub, sender, template, id)
+    using = kwargs.get('using')
+
+    with batch():
+        for subs in _subscriptions(sender):
+            # if instance not in queryset, no need to remove it
+            # or update the queryset
+            subs = [sub for sub in subs if instance.id in sub.queryset]
+            if not subs:
+                continue
+
+            template = model_templates[subs[0].subscriber.model_template]
+            queryset = subs[0].build_queryset()
+            new_qs = list(queryset.values_list('id', flat=True))
+            old = _update(subs, new_qs)
+
+            for sub in subs:
+                old_qs = old[sub.pk]
+                diff = {
+                    'inserted': set(new_qs).difference(set(old_qs)),
+                    'removed': set(old_qs).difference(set(new_qs))
+                }
+
+                for id in diff['removed']:
+                    send_remove(sub, sender, template, id, using)
+                for id in diff['inserted']:
+                    send_insert(sub, sender, template, id, using)
@@ -93,6 +93,7 @@
       case 'insert': constructDOM(data.params); break;
       case 'remove': removeDOM(data.params); break;
       case 'change': changeDOM(data.params); break;
+      case 'batch': data.params.forEach(handleDDP); break;
       default: break;
     };
   };
@@ -29,6 +29,6 @@ class Message(Publishable, models.Model):
     def __str__(self):
         return self.message
 
-    @publish
+    @publish(select_related=['user'])
     def messages(cls, user):
         return cls.objects.all()
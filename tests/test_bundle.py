@@ -62,5 +62,153 @@ def test_bundle_js():
     assert OtherComponent.attrs.onclick == 'OtherComponent_onclick(this)'
 
 
+def test_bundle_js_same_names():
+    from ryzom.bundle.js import components
+
+    def first():
+        class Alert(Component):
+            def show():
+                alert('first')
+
+            def py2js(self):
+                self.show()
+        return Alert
+
+    def second():
+        class Alert(Component):
+            def show():
+                alert('second')
+
+            def py2js(self):
+                self.show()
+        return Alert
+
+    first, second = first(), second()
+    js = components(first, second)
+    assert 'first' in js and 'second' in js
+    assert components(first, first) == components(first)
+
+
 def test_bundle_css():
     assert_equals_fixture('test_bundle', bundle.css(__name__), suffix='.css')
+
+
+def test_disk_cache(tmp_path, monkeypatch):
+    from py2js.transpiler import cache
+    from ryzom.cache import disk_cache
+
+    monkeypatch.setenv('RYZOM_CACHE_DIR', str(tmp_path))
+    js, css = bundle.js(__name__), bundle.css(__name__)
+    disk = disk_cache()
+    assert disk.misses and not disk.hits
+
+    assert bundle.js(__name__) == js
+    assert bundle.css(__name__) == css
+    assert disk.hits == 2
+
+    # transpilation results are shared by processes
+    cache.clear()
+    component = OtherComponent()
+    result = component.render_js()
+    cache.clear()
+    hits = disk.hits
+    assert component.render_js() == result
+    assert disk.hits == hits + 1
+
+
+def test_disk_cache_unwritable(tmp_path, monkeypatch):
+    import os
+    from ryzom.cache import DiskCache
+
+    disk = DiskCache(str(tmp_path / 'cache'))
+    disk.set('a', 'x')
+    assert disk.get('a') == 'x'
+
+    def replace(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', replace)
+    disk.set('b', 'y')
+    assert disk.get('b') is None
+    # the temporary file was removed
+    assert sorted(
+        name for root, dirs, files in os.walk(disk.path) for name in files
+    ) == [os.path.basename(disk.filename('a'))]
+
+    # a file in the way of the directory
+    (tmp_path / 'file').write_text('')
+    disk = DiskCache(str(tmp_path / 'file'))
+    disk.set('a', 'x')
+    assert disk.get('a') is None
+
+
+def test_incremental(tmp_path, monkeypatch):
+    import importlib
+    import os
+    from ryzom import cache
+
+    monkeypatch.delenv('RYZOM_CACHE_DIR', raising=False)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    source = tmp_path / 'incremental_components.py'
+    source.write_text(
+        'from ryzom.components import Component\n'
+        'class A(Component):\n'
+        '    def onclick(target):\n'
+        '        print("a")\n'
+    )
+    module = importlib.import_module('incremental_components')
+    cache.pieces.clear()
+
+    report = []
+    result = bundle.js(module.__name__, __name__, report=report)
+    names = [name for name, seconds in report]
+    assert 'js incremental_components.A' in names
+    assert 'js tests.test_bundle.OtherComponent' in names
+
+    report = []
+    assert bundle.js(module.__name__, __name__, report=report) == result
+    assert report == []
+
+    source.write_text(source.read_text().replace('"a"', '"b"'))
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    importlib.reload(module)
+    result = bundle.js(module.__name__, __name__, report=report)
+    assert [name for name, seconds in report] == [
+        'js incremental_components.A',
+    ]
+    assert "console.log('b')" in result
+
+
+def test_jobs(monkeypatch):
+    from ryzom import cache
+
+    monkeypatch.delenv('RYZOM_CACHE_DIR', raising=False)
+    modules = ('ryzom_mdc.html', __name__)
+    cache.pieces.clear()
+    js, css = bundle.js(*modules), bundle.css(*modules)
+
+    cache.pieces.clear()
+    report = []
+    assert bundle.js(*modules, report=report, jobs=2) == js
+    assert bundle.css(*modules, report=report, jobs=2) == css
+    names = [name for name, seconds in report]
+    assert 'js ryzom_mdc.html.MDCDialog' in names
+    assert 'css tests.test_bundle.MyComponent' in names
+
+
+def test_compile_batch(monkeypatch):
+    from ryzom.bundle.css import cache, compile_batch, compile_sass, sass
+
+    monkeypatch.delenv('RYZOM_CACHE_DIR', raising=False)
+    sources = [
+        '.A\n  $x: 1px\n  margin: $x\n  &:hover\n    color: red\n',
+        '@media (max-width: 700px)\n  .B\n    display: none\n',
+        '%p\n  a: b\n.C\n  @extend %p\n',
+    ]
+    expected = [sass.compile(string=src, indented=True) for src in sources]
+    cache.clear()
+    compile_batch(sources)
+    # @extend could change the output of other sources, compiled alone
+    assert sources[1] in cache and sources[2] not in cache
+    assert [compile_sass(src) for src in sources] == expected
@@ -229,3 +229,200 @@ Body
 <a href="/bye">link</a></li>
 </ul>
 '''.strip()
+
+
+def test_iter_html():
+    class Custom(html.Div):
+        def to_html(self, *content, **context):
+            self.attrs.custom = 'yes'
+            return super().to_html(*content, **context)
+
+    comp = html.Ul(
+        *[html.Li(i) for i in range(3)],
+        Custom('custom'),
+        html.CList(html.Span('in list')),
+        cls='list',
+    )
+    chunks = list(comp.iter_html())
+    assert len(chunks) > 3
+    assert ''.join(chunks) == comp.to_html()
+    assert 'custom="yes"' in ''.join(chunks)
+    assert ''.join(comp.iter_render()) == comp.render()
+
+
+def test_render_plan():
+    class Foo(html.Div):
+        attrs = dict(cls='foo', data_x='"x"')
+
+    def render(component):
+        component.id = 'a'
+        return component.to_html()
+
+    assert Foo.render_plan.opening == (
+        '<div class="foo" data-x="&quot;x&quot;" ryzom-id="'
+    )
+    assert Foo.render_plan.closing == '</div>'
+    assert render(Foo()) == Foo.render_plan.opening + 'a"></div>'
+    assert render(Foo(addcls='bar')) == (
+        '<div class="foo bar" data-x="&quot;x&quot;" ryzom-id="a"></div>'
+    )
+    assert render(Foo(tag='hr', selfclose=True)) == (
+        '<hr class="foo" data-x="&quot;x&quot;" ryzom-id="a"/>'
+    )
+    assert render(html.Input()) == '<input  ryzom-id="a">'
+
+
+def test_attrs_copy_on_access():
+    class Foo(html.Component):
+        attrs = dict(cls='foo')
+        style = dict(color='red')
+        scripts = ['foo.js']
+
+    foo = Foo()
+    assert 'attrs' not in foo.__dict__
+    foo.attrs.addcls = 'bar'
+    foo.style.margin = 0
+    foo.scripts.append('bar.js')
+    assert foo.attrs == {'class': 'foo Foo bar', 'style': {'margin': 0}}
+    assert Foo.attrs == {'class': 'foo Foo', 'style': {'color': 'red'}}
+    assert Foo.scripts == ['foo.js']
+    assert Foo().to_html().startswith('<foo class="foo Foo" ')
+
+
+def test_text_node():
+    import importlib
+    from django.utils.safestring import mark_safe
+    from ryzom.components import TextNode
+    # escapes text nodes
+    importlib.import_module('ryzom_django.html')
+
+    div = html.Div('<b>', 1, mark_safe('<i>'))
+    assert [type(c) for c in div.content] == [TextNode] * 3
+    assert div.content[1].parent is div and div.content[1].position == 1
+    assert div.content[0] == html.Text('<b>')
+    assert div.content_html(*div.content) == '&lt;b&gt;1<i>'
+    obj = div.content[0].to_obj()
+    assert obj['parent'] == div.id and obj['content'] == '<b>'
+
+
+def test_to_obj():
+    class Button(html.Button):
+        def __init__(self, label, **attrs):
+            self.label = label
+            super().__init__(**attrs)
+
+        def py2js(self):
+            getElementByUuid(self.id).value = self.label
+
+    div = html.Div(
+        html.Span('a', cls='x'),
+        Button('b', id='b1'),
+        Button('c', id='c1'),
+        id='d',
+        parent='p',
+    )
+    obj = div.to_obj()
+    assert obj['parent'] == 'p' and obj['tag'] == 'div'
+    span, b, c = obj['content']
+    assert span['attrs'] == {'class': 'x'} and span['parent'] == 'd'
+    assert span['content'][0]['content'] == 'a'
+    assert b['script'].strip() == 'getElementByUuid("b1").value = "b";'
+    assert c['script'].strip() == 'getElementByUuid("c1").value = "c";'
+
+
+def test_render_js_mixin():
+    class ScriptMixin:
+        def render_js(self):
+            return 'mixin();'
+
+    class Other:
+        pass
+
+    class Scripted(ScriptMixin, html.Div):
+        pass
+
+    class Plain(html.Div, Other):
+        pass
+
+    assert 'mixin();' in Scripted().to_html()
+    assert Scripted().to_obj()['script'] == 'mixin();'
+    # a base after Component doesn't make it look like it renders js
+    assert not Plain.render_plan.js
+
+    # py2js set on an instance only
+    def py2js():
+        alert('plain')
+
+    div = html.Div()
+    div.py2js = py2js
+    assert div.render_js() and '<script' in div.to_html()
+    assert div.to_obj()['script'] == div.render_js()
+    assert '<script' not in html.Div().to_html()
+
+
+def test_class_attrs_changed():
+    class Foo(html.Div):
+        attrs = dict(a='1')
+
+    Foo().to_html()
+    Foo.attrs['b'] = '2'
+    touched = Foo()
+    touched.attrs
+    assert 'a="1" b="2"' in Foo().to_html()
+    assert 'a="1" b="2"' in touched.to_html()
+    assert Foo().to_obj()['attrs'] == {'a': '1', 'b': '2'}
+
+
+def test_to_obj_attrs():
+    class Link(html.A):
+        attrs = dict(href='/')
+
+    obj = Link().to_obj()
+    obj['attrs']['href'] = '/x'
+    assert Link().to_obj()['attrs'] == {'href': '/'}
+    assert 'href="/"' in Link().to_html()
+
+
+def test_to_obj_deep():
+    root = child = html.Div(parent='p')
+    for i in range(5000):
+        child.content.append(html.Div())
+        child.content[-1].parent = child
+        child = child.content[-1]
+    obj = root.to_obj()
+    for i in range(5000):
+        obj = obj['content'][0]
+    assert obj['parent'] == child.parent.id
+
+
+def test_recording():
+    from ryzom import components
+    div = html.Div(html.Span('x'))
+    with components.recording() as classes:
+        html.P()
+    assert classes == {html.P}
+    assert components.component_classes(div) == {
+        html.Div, html.Span, components.TextNode}
+
+
+class Styled(html.Div):
+    style = dict(color='red')
+
+
+class Scripted(Styled):
+    def onclick(element):
+        pass
+
+
+def test_registered():
+    from ryzom.components import registered
+
+    class Local(html.Div):
+        pass
+
+    assert Local not in registered(__name__)
+    assert Styled in registered(__name__, css=True)
+    assert Styled not in registered(__name__, js=True)
+    assert Scripted in registered(__name__, js=True)
+    assert not Scripted.bundle_css
+    assert Styled in registered('ryzom.html', __name__)
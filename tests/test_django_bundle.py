@@ -0,0 +1,147 @@
+import gzip
+import json
+import re
+
+import pytest
+from django.test import override_settings
+
+from ryzom_django import bundle
+
+
+def test_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        bundle, 'get_component_modules', lambda: ['tests.test_bundle'])
+    (tmp_path / 'bundle.000000000000.js').write_text('old')
+
+    result = bundle.write(tmp_path)
+    assert json.loads((tmp_path / 'bundle.json').read_text()) == result
+    assert not (tmp_path / 'bundle.000000000000.js').exists()
+
+    js = (tmp_path / result['bundle.js']).read_bytes()
+    assert js == (tmp_path / 'bundle.js').read_bytes()
+    assert b'\n  ' not in js and b'connectedCallback' in js
+    assert gzip.decompress(
+        (tmp_path / f'{result["bundle.js"]}.gz').read_bytes()) == js
+    assert bundle.write(tmp_path) == result
+
+    monkeypatch.setattr(bundle, 'manifest', lambda: result)
+    with override_settings(DEBUG=False):
+        assert result['bundle.css'] in bundle.CSSBundle().to_html()
+
+
+def test_example_bundle():
+    # ryzom_mdc components are re-exported by ryzom_django_mdc.html
+    bundle.get_component_modules.cache_clear()
+    js, css = bundle.js(), bundle.css()
+    assert 'MDCSnackBar' in js and 'MDCSelectOutlined' in js
+    assert 'MDCCheckboxListItem_click_input' in js
+    assert '.MDCErrorList' in css and '.MDCField' in css
+
+
+def test_pages(rf, monkeypatch):
+    from ryzom_django.html import Html
+    from ryzom_mdc import html as mdc
+
+    monkeypatch.setattr(
+        bundle, 'get_component_modules', lambda: ['ryzom_mdc.html'])
+    bundle.known_classes.cache_clear()
+    bundle.code_classes.cache_clear()
+
+    class Page(Html):
+        body_class = mdc.Body
+
+    class Lazy(mdc.Div):
+        def to_html(self, *content, **context):
+            return mdc.MDCSnackBar('hi').to_html(**context)
+
+    with override_settings(
+            RYZOM_BUNDLE_PAGES=True, ROOT_URLCONF=bundle.__name__):
+        result = Page(
+            mdc.MDCErrorList('oops'), Lazy()).render()
+
+    js = re.search('src="([^"]*)"', result).group(1).replace('&amp;', '&')
+    assert js.startswith('/bundle.js?v=') and len(js) < 64
+    # the body has py2js, which is rendered inline rather than bundled
+    assert set(bundle.page_query(rf.get(js), 'js')) == {
+        mdc.Body, mdc.MDCSnackBar}
+    css = re.search('href="(/bundle.css[^"]*)"', result).group(1)
+    css = css.replace('&amp;', '&')
+    classes = bundle.page_query(rf.get(css), 'css')
+    assert mdc.MDCErrorList in classes
+    assert mdc.MDCAccordionMenu not in classes
+
+    response = bundle.CSSBundleView.as_view()(rf.get(css))
+    code = response.content.decode('utf8')
+    assert '.MDCErrorList' in code and '.MDCAccordionMenu' not in code
+
+    response = bundle.JSBundleView.as_view()(rf.get(js))
+    assert 0 < len(response.content) < len(bundle.js())
+
+    # urls of other class sets get the whole bundle
+    stale = re.sub('v=[^&]*', 'v=0', js)
+    response = bundle.JSBundleView.as_view()(rf.get(stale))
+    assert response.content.decode('utf8') == bundle.js()
+    bundle.known_classes.cache_clear()
+    bundle.code_classes.cache_clear()
+
+
+def test_get_component_modules():
+    bundle.get_component_modules.cache_clear()
+    assert bundle.get_component_modules() == [
+        'ryzom_django_example.views',
+        'ryzom_django.html',
+        'ryzom_django_autocomplete.html',
+        'ryzom_django_mdc.html',
+    ]
+    assert bundle.get_component_modules() is bundle.get_component_modules()
+
+    with override_settings(RYZOM_COMPONENT_SUBMODULES=['html']):
+        assert 'ryzom_django_example.views' not in (
+            bundle.get_component_modules())
+
+    with override_settings(RYZOM_COMPONENT_MODULES=['ryzom_mdc.html']):
+        assert bundle.get_component_modules() == ['ryzom_mdc.html']
+
+
+def test_get_component_modules_broken(tmp_path, monkeypatch):
+    app = tmp_path / 'ryzom_broken_app'
+    app.mkdir()
+    (app / '__init__.py').write_text('')
+    (app / 'views.py').write_text('import ryzom_missing_dependency')
+    (app / 'components.py').write_text('raise RuntimeError("broken")')
+    monkeypatch.syspath_prepend(tmp_path)
+
+    # missing dependencies are skipped, other errors are bugs
+    with override_settings(INSTALLED_APPS=[
+            'ryzom_django', 'ryzom_broken_app', 'ryzom_django_mdc']):
+        with pytest.raises(RuntimeError):
+            bundle.get_component_modules()
+        with override_settings(RYZOM_COMPONENT_SUBMODULES=['views', 'html']):
+            assert bundle.get_component_modules() == [
+                'ryzom_django.html', 'ryzom_django_mdc.html']
+    bundle.get_component_modules.cache_clear()
+
+
+def test_conditional_get(rf, monkeypatch):
+    monkeypatch.setattr(
+        bundle, 'get_component_modules', lambda: ['tests.test_bundle'])
+    builds = []
+    monkeypatch.setattr(
+        bundle.JSBundleView, 'build',
+        lambda self, classes: builds.append(1) or 'js')
+    bundle.BundleView.bodies.clear()
+    view = bundle.JSBundleView.as_view()
+
+    response = view(rf.get('/bundle.js'))
+    assert response.status_code == 200 and response.content == b'js'
+    etag = response['ETag']
+
+    response = view(rf.get('/bundle.js', HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 304 and response['ETag'] == etag
+    response = view(rf.get(
+        '/bundle.js', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']))
+    assert response.status_code == 304
+
+    assert view(rf.get('/bundle.js')).content == b'js'
+    assert len(builds) == 1
+    assert bundle.CSSBundleView.as_view()(rf.get('/bundle.css'))['ETag'] != etag
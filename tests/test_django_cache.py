@@ -0,0 +1,71 @@
+import pickle
+
+from django.contrib.auth.models import User
+
+from ryzom import html
+from ryzom_django.cache import CachedFragment, get_cache, invalidate_fragments
+
+
+class Footer(html.Div):
+    cache_models = [User]
+    instances = 0
+    language = 'en'
+
+    def __init__(self, *content, **attrs):
+        type(self).instances += 1
+        super().__init__('footer', self.language, *content, **attrs)
+
+    @classmethod
+    def cache_key(cls):
+        return cls.language
+
+
+class Signature(html.Div):
+    def cache_key(self):
+        return self.content[-1].content
+
+
+def test_cached_fragment():
+    get_cache().clear()
+    Footer.instances = 0
+    first = CachedFragment(Footer).to_html()
+    assert CachedFragment(Footer).to_html() == first
+    assert Footer.instances == 1
+    assert first in html.Body(CachedFragment(Footer)).to_html()
+    assert Footer.instances == 1
+
+    # class keys are called on cache hits too
+    Footer.language = 'fr'
+    try:
+        assert 'fr' in CachedFragment(Footer).to_html()
+        assert Footer.instances == 2
+    finally:
+        Footer.language = 'en'
+    assert CachedFragment(Footer).to_html() == first
+    assert Footer.instances == 2
+
+    invalidate_fragments(User)
+    assert CachedFragment(Footer).to_html() != first
+    assert Footer.instances == 3
+
+
+def test_cached_fragment_instance_key():
+    get_cache().clear()
+    assert CachedFragment(Signature('a')).to_html() == CachedFragment(
+        Signature, 'a').to_html()
+    assert 'b' in CachedFragment(Signature, 'b').to_html()
+    assert len(get_cache()) == 2
+
+
+def test_cached_fragment_picklable():
+    get_cache().clear()
+    fragment = CachedFragment(Footer)
+    fragment.to_html()
+    cached = get_cache().get(fragment.get_key(), version=fragment.get_version())
+    assert (Footer.__module__, 'Footer') in pickle.loads(pickle.dumps(cached))[1]
+
+
+def test_cached_fragment_not_cacheable():
+    fragment = CachedFragment(html.Div, 'x')
+    assert fragment.get_key() is None
+    assert fragment.to_html() == fragment.component.to_html()
@@ -12,7 +12,7 @@ if settings.CHANNELS_ENABLE:
     from asgiref.sync import sync_to_async
     from channels.auth import AuthMiddlewareStack
     from channels.testing import WebsocketCommunicator
-    from ryzom_django_channels.consumers import Consumer
+    from ryzom_django_channels.consumers import AsyncConsumer, Consumer
     from ryzom_django_channels.models import (
         Client, Subscription, Registration, Publication)
     from ryzom_django_channels.views import ReactiveMixin
@@ -197,6 +197,21 @@ async def test_ws_reload(ws_empty):
     await ws_empty.disconnect()
 
 
+@async_db_reactive
+async def test_async_ws_reload():
+    communicator = WebsocketCommunicator(
+        AuthMiddlewareStack(AsyncConsumer.as_asgi()),
+        '/ws/ddp/')
+    connected, _ = await communicator.connect()
+    assert connected
+    res = await communicator.receive_json_from()
+    assert res['type'] == 'Reload'
+    await communicator.send_json_to({'id': 1, 'type': 'ping', 'params': {}})
+    res = await communicator.receive_json_from()
+    assert res['type'] == 'Reload'
+    await communicator.disconnect()
+
+
 @async_db_reactive
 @pytest.mark.skip(reason='Broken minor release of Django and Channels?')
 async def test_ws_connected(ws_token):
@@ -222,3 +237,332 @@ async def test_register_changed(ws, async_reg_comp, view):
     assert ('changed'
             in res['params']['params']['content'][0]['content'])
     await ws.disconnect()
+
+
+def test_outbox_coalesce():
+    from types import SimpleNamespace
+    from ryzom_django_channels.ddp import Outbox
+
+    client = SimpleNamespace(channel='channel')
+    sub = SimpleNamespace(client=client, subscriber_id='s', queryset=[1, 2])
+    outbox = Outbox()
+
+    outbox.add('inserted', sub, None, None, 1)
+    outbox.add('changed', sub, None, None, 1)
+    outbox.add('changed', sub, None, None, 2)
+    outbox.add('removed', sub, None, None, 2)
+    outbox.add('inserted', sub, None, None, 3)
+    outbox.add('removed', sub, None, None, 3)
+    outbox.add('removed', sub, None, None, 4)
+    outbox.add('inserted', sub, None, None, 4)
+    assert [
+        (type, id) for type, _, _, _, id in outbox.messages['channel'].values()
+    ] == [('inserted', 1), ('removed', 2), ('changed', 4)]
+
+
+class Row(html.Div):
+    def __init__(self, instance):
+        super().__init__(str(instance.pk), id=f'row-{instance.pk}')
+
+
+@pytest.fixture
+def channel_layer(monkeypatch):
+    from types import SimpleNamespace
+    from ryzom_django_channels import ddp
+
+    sent = []
+
+    async def send(channel, message):
+        sent.append((channel, message))
+
+    monkeypatch.setattr(
+        ddp, 'get_channel_layer', lambda: SimpleNamespace(send=send))
+    return sent
+
+
+def remove(id):
+    from types import SimpleNamespace
+    from django.contrib.auth.models import User
+    from ryzom_django_channels.ddp import send_remove
+
+    client = SimpleNamespace(channel='channel')
+    sub = SimpleNamespace(client=client, subscriber_id='s', queryset=[])
+    send_remove(sub, User, Row, id)
+
+
+def sent_ids(sent):
+    return [
+        [message['id'] for message in params['params']['messages']]
+        for channel, params in sent
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_outbox_on_commit(channel_layer):
+    from django.db import transaction
+
+    with transaction.atomic():
+        remove(1)
+        remove(2)
+        assert not channel_layer
+    assert sent_ids(channel_layer) == [['row-1', 'row-2']]
+    assert channel_layer[0][0] == 'channel'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_outbox_rollback(channel_layer):
+    from django.db import transaction
+
+    with transaction.atomic():
+        remove(1)
+        try:
+            with transaction.atomic():
+                remove(2)
+                raise ValueError()
+        except ValueError:
+            pass
+        with transaction.atomic():
+            remove(3)
+    assert sent_ids(channel_layer) == [['row-1'], ['row-3']]
+
+    try:
+        with transaction.atomic():
+            remove(4)
+            raise ValueError()
+    except ValueError:
+        pass
+    assert len(channel_layer) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_outbox_autocommit(channel_layer):
+    from ryzom_django_channels.ddp import batch
+
+    remove(1)
+    assert sent_ids(channel_layer) == [['row-1']]
+    with batch():
+        remove(2)
+        remove(3)
+    assert sent_ids(channel_layer) == [['row-1'], ['row-2', 'row-3']]
+
+
+batch_params = {
+    'type': 'batch',
+    'messages': [
+        {'type': 'removed', 'id': 'a', 'parent': 's'},
+        {'type': 'inserted', 'instance': {'id': 'b', 'parent': 's'}},
+        {'type': 'changed', 'instance': {'id': 'c', 'parent': 's'}},
+    ],
+}
+batch_ddp = {
+    'type': 'batch',
+    'params': [
+        {'type': 'remove', 'params': {'id': 'a', 'parent': 's'}},
+        {'type': 'insert', 'params': {'id': 'b', 'parent': 's'}},
+        {'type': 'change', 'params': {'id': 'c', 'parent': 's'}},
+    ],
+}
+
+
+@skip_reactive
+def test_ddp_params():
+    from ryzom_django_channels.consumers import ddp_params
+    assert ddp_params(batch_params) == batch_ddp
+
+
+@skip_reactive
+def test_handle_ddp_batch():
+    import json
+    consumer = Consumer()
+    sent = []
+    consumer.send = sent.append
+    consumer.handle_ddp({'type': 'handle.ddp', 'params': batch_params})
+    assert [json.loads(frame) for frame in sent] == [
+        {'type': 'DDP', 'params': batch_ddp}]
+
+
+class StandInSubscription:
+    '''Subscription of a channel to rooms, without the postgres fields.'''
+    built = 0
+
+    def __init__(self, pk, queryset, slice=None, **filters):
+        from types import SimpleNamespace
+        self.pk = pk
+        self.queryset = queryset
+        self.slice = slice
+        self.filters = filters
+        self.client = SimpleNamespace(channel=f'channel-{pk}')
+        self.subscriber_id = f'sub-{pk}'
+        self.subscriber = SimpleNamespace(model_template='test_room')
+        self.publication = SimpleNamespace(name='rooms', related=((), ()))
+
+    def build_queryset(self):
+        from ryzom_django_channels_example.models import Room
+        type(self).built += 1
+        queryset = Room.objects.filter(**self.filters).order_by('id')
+        return queryset[:self.slice] if self.slice else queryset
+
+
+@pytest.fixture
+def room_subs(monkeypatch, channel_layer):
+    from types import SimpleNamespace
+    from ryzom_django_channels import signals
+
+    groups, updates = [], []
+
+    def filter(pk__in):
+        return SimpleNamespace(
+            update=lambda queryset: updates.append((pk__in, queryset)))
+
+    monkeypatch.setattr(signals, '_subscriptions', lambda model: groups)
+    monkeypatch.setattr(
+        signals, 'Subscription',
+        SimpleNamespace(objects=SimpleNamespace(filter=filter)))
+    monkeypatch.setitem(signals.model_templates, 'test_room', Row)
+    StandInSubscription.built = 0
+    return SimpleNamespace(groups=groups, updates=updates, sent=channel_layer)
+
+
+@skip_reactive
+@pytest.mark.django_db(transaction=True)
+def test_signal_group(room_subs):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from ryzom_django_channels_example.models import Room
+
+    subs = [StandInSubscription(i, []) for i in range(3)]
+    room_subs.groups.append(subs)
+    with CaptureQueriesContext(connection) as queries:
+        room = Room.objects.create(name='a')
+    selects = [q for q in queries if q['sql'].startswith('SELECT')]
+
+    assert StandInSubscription.built == 1
+    # exists() then the ids, and the templates' in_bulk()
+    assert len(selects) == 3
+    assert room_subs.updates == [([0, 1, 2], [room.id])]
+    assert [sub.queryset for sub in subs] == [[room.id]] * 3
+    assert sorted(channel for channel, message in room_subs.sent) == [
+        'channel-0', 'channel-1', 'channel-2']
+
+
+@skip_reactive
+@pytest.mark.django_db(transaction=True)
+def test_signal_skip(room_subs):
+    from ryzom_django_channels_example.models import Room
+
+    room_subs.groups.append([StandInSubscription(0, [], name='a')])
+    Room.objects.create(name='b')
+    assert StandInSubscription.built == 1
+    assert not room_subs.updates
+    assert not room_subs.sent
+
+
+@skip_reactive
+@pytest.mark.django_db(transaction=True)
+def test_signal_sliced(room_subs):
+    from ryzom_django_channels_example.models import Room
+
+    first = Room.objects.create(name='a')
+    sub = StandInSubscription(0, [first.id], slice=1, name__in=['a', 'b'])
+    room_subs.groups.append([sub])
+
+    # not in the old queryset and not filtered, but sliced out
+    second = Room.objects.create(name='b')
+    second.save()
+    assert not room_subs.updates
+    assert not room_subs.sent
+
+    first.save()
+    assert [
+        (message['type'], message['instance']['id'])
+        for message in room_subs.sent.pop()[1]['params']['messages']
+    ] == [('changed', f'row-{first.id}')]
+
+    first.name = 'c'
+    first.save()
+    assert room_subs.updates == [([0], [second.id])]
+    assert sub.queryset == [second.id]
+    assert [
+        message['type'] for message in
+        room_subs.sent[0][1]['params']['messages']
+    ] == ['removed', 'inserted']
+
+
+class PermissionRow(html.Div):
+    to_objs = 0
+
+    def __init__(self, instance):
+        super().__init__(
+            instance.content_type.app_label, id=f'perm-{instance.pk}')
+
+    def to_obj(self, context=None):
+        type(self).to_objs += 1
+        return super().to_obj(context)
+
+
+class StandInPublication:
+    '''Publication of a publish(select_related=...) function.'''
+    calls = 0
+    name = 'permissions'
+
+    @property
+    def related(self):
+        type(self).calls += 1
+        return (('content_type',), ())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_outbox_shares_payloads(channel_layer):
+    from types import SimpleNamespace
+    from django.contrib.auth.models import Permission
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from ryzom_django_channels.ddp import Outbox
+
+    ids = list(Permission.objects.values_list('pk', flat=True)[:2])
+    app_label = Permission.objects.get(pk=ids[0]).content_type.app_label
+    outbox = Outbox()
+    for i in range(3):
+        outbox.add('changed', SimpleNamespace(
+            client=SimpleNamespace(channel=f'channel-{i}'),
+            subscriber_id=f'sub-{i}',
+            queryset=ids,
+            publication=StandInPublication(),
+        ), Permission, PermissionRow, ids[0])
+    outbox.add('inserted', SimpleNamespace(
+        client=SimpleNamespace(channel='channel-0'),
+        subscriber_id='sub-3',
+        queryset=ids,
+        publication=StandInPublication(),
+    ), Permission, PermissionRow, ids[1])
+
+    PermissionRow.to_objs = StandInPublication.calls = 0
+    with CaptureQueriesContext(connection) as queries:
+        outbox.flush()
+
+    # one in_bulk() with the content types joined
+    assert len(queries) == 1
+    assert 'django_content_type' in queries[0]['sql']
+    assert StandInPublication.calls == 1
+    assert PermissionRow.to_objs == 2
+
+    messages = {
+        channel: message['params']['messages']
+        for channel, message in channel_layer
+    }
+    assert [m['instance']['parent'] for m in messages['channel-0']] == [
+        'sub-0', 'sub-3']
+    assert messages['channel-2'][0]['instance']['parent'] == 'sub-2'
+    assert messages['channel-2'][0]['instance']['content'][0]['content'] == (
+        app_label)
+
+
+@skip_reactive
+def test_publication_related():
+    from ryzom_django_channels_example.models import Message
+    publication = Publication(
+        name='messages',
+        model_module=Message.__module__,
+        model_class='Message',
+    )
+    assert publication.related == (('user',), ())
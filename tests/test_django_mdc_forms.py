@@ -51,3 +51,21 @@ def test_form_to_component_override():
             return html.CList(self['char'], self['datetime'])
     result = TestForm().to_html()
     test.assert_equals_fixture('test_form_override', result)
+
+
+def test_view_stream(rf):
+    from ryzom_django.streaming import StreamingTemplateResponseMixin
+    from ryzom_django_example.views import ExampleFormView
+
+    class StreamingView(StreamingTemplateResponseMixin, ExampleFormView):
+        pass
+
+    request = rf.get('/')
+    expected = ExampleFormView.as_view()(request).render().content
+    response = StreamingView.as_view()(request)
+    assert response.streaming
+    result = b''.join(response.streaming_content)
+    test.assert_equals(
+        test.normalize(expected.decode('utf8')),
+        test.normalize(result.decode('utf8')),
+    )
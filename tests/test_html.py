@@ -3,3 +3,24 @@ from ryzom.components import CAttrs
 
 def test_doublequote_escape():
     assert CAttrs(a='"b"').to_html() == 'a="&quot;b&quot;"'
+
+
+def test_lazy_tags_threads():
+    import threading
+    from ryzom import html
+
+    vars(html).pop('Xmp', None)
+    barrier = threading.Barrier(8)
+    classes = []
+
+    def get():
+        barrier.wait()
+        classes.append(html.Xmp)
+
+    threads = [threading.Thread(target=get) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(classes) == 8 and len(set(classes)) == 1
+    assert html.Xmp is classes[0] and html.Xmp.tag == 'xmp'
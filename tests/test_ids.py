@@ -0,0 +1,22 @@
+from ryzom import html, ids
+
+
+def test_base62():
+    assert ids.base62(0) == '0'
+    assert ids.base62(61) == 'Z'
+    assert ids.base62(62) == '10'
+
+
+def test_counter_generator():
+    with ids.generator(ids.Counter('t')):
+        div = html.Div(html.Div('a'), html.Hr(), id='x')
+    assert div.id == 'x'
+    assert div.content[0].id == 't0'
+    assert div.content[1].id == 't1'
+    assert div.render().startswith('<div id="x" ryzom-id="x">\n<div  ryzom-id="t0">a</div>')
+    assert not html.Div().id.startswith('t')
+
+
+def test_default_unique():
+    assert len({html.Text('a').id for i in range(1000)}) == 1000
+    assert ids.default.prefix != ids.Counter().prefix
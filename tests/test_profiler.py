@@ -0,0 +1,69 @@
+from py2js import transpiler
+
+from ryzom import components, html
+from ryzom.profiler import profile
+
+
+class Row(html.Tr):
+    def __init__(self, i):
+        super().__init__(html.Td(str(i)), html.Td(html.Span('x')))
+
+
+def test_profile():
+    table = html.Table(*[Row(i) for i in range(10)])
+    expected = table.render()
+
+    with profile() as profiler:
+        assert table.render() == expected
+        transpiler.convert_py2js('a = 1')
+
+    stats = profiler.as_dict()
+    assert stats[f'{__name__}.Row']['count'] == 10
+    assert stats['ryzom.components.Td']['count'] == 20
+    assert stats['py2js']['count'] == 1
+    for row in stats.values():
+        assert 0 <= row['self'] <= row['cumulative']
+
+    collapsed = profiler.collapsed().splitlines()
+    assert (
+        f'ryzom.components.Table;{__name__}.Row;'
+        'ryzom.components.Td;ryzom.components.Span'
+    ) in [line.rsplit(' ', 1)[0] for line in collapsed]
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in collapsed)
+
+
+def test_profile_restores():
+    html_chunks = components.html_chunks
+    to_html = components.Component.__dict__['to_html']
+    with profile():
+        with profile():
+            assert components.html_chunks is not html_chunks
+        assert components.html_chunks is not html_chunks
+    assert components.html_chunks is html_chunks
+    assert components.Component.__dict__['to_html'] is to_html
+
+
+class Page(html.Div):
+    def __init__(self):
+        super().__init__(*[Row(i) for i in range(500)])
+
+
+def test_profile_stream():
+    from ryzom_django.template_backend import Ryzom, Template
+
+    backend = Ryzom(dict(
+        NAME='ryzom', DIRS=[], APP_DIRS=False, OPTIONS=dict(debug=True)))
+    template = Template(Page, backend)
+    stream = template.render_stream()
+    with profile() as profiler:
+        chunks = list(stream)
+    assert len(chunks) > 1
+
+    stats = profiler.as_dict()
+    assert stats[f'{__name__}.Row']['count'] == 500
+    # rows render within the template frame, named like the component
+    page = f'{__name__}.Page'
+    assert any(
+        line.startswith(f'{page};{page};{__name__}.Row ')
+        for line in profiler.collapsed().splitlines()
+    )
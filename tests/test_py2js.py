@@ -365,3 +365,36 @@ def test_transpile_template():
         return f'foo {bar}{1 + b}'
     result = py2js.transpile(foo)
     assert_equals_fixture('test_transpile_template', result)
+
+
+def test_transpile_cache():
+    from py2js.transpiler import cache
+
+    class Button:
+        def __init__(self, id, n):
+            self.id = id
+            self.n = n
+
+        def py2js(self):
+            getElementByUuid(self.id).value = self.n + token
+
+    cache.clear()
+    a = Button('a', 1)
+    assert py2js.transpile_body(a.py2js, self=a, token='t') == (
+        'getElementByUuid("a").value = (1 + "t");\n'
+    )
+    assert (cache.hits, cache.misses) == (0, 1)
+    b = Button('b', 1)
+    assert py2js.transpile_body(b.py2js, self=b, token='u') == (
+        'getElementByUuid("b").value = (1 + "u");\n'
+    )
+    assert (cache.hits, cache.misses) == (1, 1)
+    c = Button('c', 2)
+    assert py2js.transpile_body(c.py2js, self=c, token='v') == (
+        'getElementByUuid("c").value = (2 + "v");\n'
+    )
+    assert (cache.hits, cache.misses) == (1, 2)
+    # objects are not keyed, they are transpiled every time
+    c.n = object()
+    py2js.transpile_body(c.py2js, self=c, token='v')
+    assert (cache.hits, cache.misses) == (1, 2)